@@ -5,8 +5,9 @@ import sys
 from flask import Flask
 
 from config import app_config
-from api_service.extensions import api, db, swag, celery
+from api_service.extensions import api, db, swag, celery, redis_store
 from api_service.services import views as serv_views
+from api_service.commands import indexes_cli, cache_cli
 
 
 def create_app(config_mode=os.environ.get('APP_MODE')):
@@ -15,10 +16,14 @@ def create_app(config_mode=os.environ.get('APP_MODE')):
     """
     app = Flask(__name__)
     app.config.from_object(app_config[config_mode])
+    if not app.config.get('SECRET_KEY'):
+        # Pagination cursors are signed with the secret key
+        raise RuntimeError('SECRET_KEY is not set.')
     with app.app_context():
         # Initialize Plugins
         register_extensions(app)
         register_blueprints(app)
+        register_commands(app)
         init_celery(app)
         configure_logger(app)
         return app
@@ -29,11 +34,14 @@ def register_extensions(app):
     Register Flask extensions.
     """
     api.add_resource(serv_views.ServicesApi, '/services')
+    api.add_resource(serv_views.ServicesBulkApi, '/services/bulk')
+    api.add_resource(serv_views.ServicesExportApi, '/services/export')
     api.add_resource(serv_views.ServiceApi, '/services/<string:service_id>')
     api.add_resource(serv_views.WatchdogApi, '/watchdog')
     api.init_app(app)
     db.init_app(app)
     swag.init_app(app)
+    redis_store.init_app(app)
 
 
 def register_blueprints(app):
@@ -43,6 +51,14 @@ def register_blueprints(app):
     app.register_blueprint(serv_views.serv_bp)
 
 
+def register_commands(app):
+    """
+    Register Flask CLI commands.
+    """
+    app.cli.add_command(indexes_cli)
+    app.cli.add_command(cache_cli)
+
+
 def init_celery(app=None):
     """
     Initialize celery.
@@ -0,0 +1,130 @@
+import click
+from bson import ObjectId
+from flask import current_app
+from flask.cli import AppGroup
+from mongoengine.queryset.visitor import Q
+
+from api_service.models import Service
+from api_service.watchdog_celery.sweeps import due_query, ensure_sweep_retention, get_sweep_retention
+from api_service.services.utils import get_response_cache
+
+
+indexes_cli = AppGroup('indexes', help='Manage indexes of the service collection.')
+cache_cli = AppGroup('cache', help='Manage cache of the services pages.')
+
+
+def get_service_collection():
+    """
+    Returns the service collection (without index creation done by mongoengine on first collection access).
+    """
+    return Service._get_db()[Service._get_collection_name()]
+
+
+def get_missing_indexes() -> list:
+    """
+    Returns indexes declared in the Service model which do not exist in the collection.
+    """
+    existing_indexes = [index['key'] for index in get_service_collection().index_information().values()]
+    return [index for index in Service.list_indexes() if index not in existing_indexes]
+
+
+def get_hot_queries() -> dict:
+    """
+    Returns cursors of the queries executed by the API and the watchdog most frequently.
+    """
+    collection = get_service_collection()
+    name_seek = Q(name__gt='service') | Q(name='service', id__gt=ObjectId())
+    return {
+        'services page sorted by id': Service.objects.order_by('id').limit(31),
+        'services page sorted by name (seek)': Service.objects(name_seek).order_by('name', 'id').limit(31),
+        'services with up status': Service.objects(status='up'),
+        'service by name': Service.objects(name='service'),
+        'watchdog due services': collection.find(due_query(), projection={'_id': 1}),
+    }
+
+
+def plan_summary(plan: dict) -> str:
+    """
+    Returns the chain of the query plan stages (e.g. 'LIMIT > FETCH > IXSCAN name_1__id_1').
+    """
+    stage = plan.get('stage', '')
+    if plan.get('indexName'):
+        stage = f'{stage} {plan["indexName"]}'
+    input_stages = plan.get('inputStages') or ([plan['inputStage']] if 'inputStage' in plan else [])
+    if not input_stages:
+        return stage
+    return f'{stage} > ' + ' | '.join(plan_summary(input_stage) for input_stage in input_stages)
+
+
+@indexes_cli.command('create')
+def create_indexes():
+    """
+    Create indexes declared in the Service model (built in the background) and the TTL index of sweep records.
+    """
+    missing_indexes = get_missing_indexes()
+    Service.ensure_indexes()
+    for index in missing_indexes:
+        click.echo(f'Created index: {index}')
+    click.echo(f'Indexes created: {len(missing_indexes)}')
+    retention = current_app.config.get('WATCHDOG_SWEEP_RETENTION')
+    if ensure_sweep_retention(Service._get_db(), retention):
+        click.echo(f'Sweep records retention set to {retention} sec')
+
+
+@indexes_cli.command('status')
+def indexes_status():
+    """
+    Report indexes declared in the Service model which are missing in the collection (and missing or outdated
+    TTL index of sweep records).
+    """
+    missing_indexes = get_missing_indexes()
+    for index in missing_indexes:
+        click.echo(f'Missing index: {index}')
+    if get_sweep_retention(Service._get_db()) != current_app.config.get('WATCHDOG_SWEEP_RETENTION'):
+        missing_indexes.append('watchdog_sweep TTL index')
+        click.echo('Missing index: watchdog_sweep TTL index (WATCHDOG_SWEEP_RETENTION)')
+    if missing_indexes:
+        click.echo('Run "flask indexes create" to create missing indexes.')
+    else:
+        click.echo('All indexes exist.')
+
+
+@indexes_cli.command('explain')
+def explain_queries():
+    """
+    Print query plans of the hot queries (collection scans are marked).
+    """
+    for query_name, cursor in get_hot_queries().items():
+        winning_plan = cursor.explain()['queryPlanner']['winningPlan']
+        summary = plan_summary(winning_plan)
+        marker = ' [COLLSCAN]' if 'COLLSCAN' in summary else ''
+        click.echo(f'{query_name}: {summary}{marker}')
+
+
+@cache_cli.command('stats')
+def cache_stats():
+    """
+    Print cache hits, misses and bypasses.
+    """
+    response_cache = get_response_cache()
+    if not response_cache:
+        click.echo('Cache is disabled (SERVICES_CACHE_TTL).')
+        return
+    metrics = response_cache.get_metrics()
+    for metric in ('hits', 'misses', 'bypasses'):
+        click.echo(f'{metric}: {metrics.get(metric, 0)}')
+    requests_count = metrics.get('hits', 0) + metrics.get('misses', 0)
+    if requests_count:
+        click.echo(f'hit ratio: {metrics.get("hits", 0) / requests_count:.2%}')
+
+
+@cache_cli.command('clear')
+def cache_clear():
+    """
+    Delete cached pages and cache metrics.
+    """
+    response_cache = get_response_cache()
+    if not response_cache:
+        click.echo('Cache is disabled (SERVICES_CACHE_TTL).')
+        return
+    click.echo(f'Deleted keys: {response_cache.clear()}')
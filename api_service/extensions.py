@@ -4,8 +4,13 @@ from flasgger import Swagger
 from celery import Celery
 
 from api_service.services.errors import errors as errors_custom
+from api_service.redis_store import RedisStore
+from api_service.representations import representations
 
 api = Api(catch_all_404s=True, errors=errors_custom)
+# Compact JSON (default), MessagePack and gzip compression negotiated with Accept and Accept-Encoding headers
+api.representations.update(representations)
 db = MongoEngine()
 swag = Swagger()
-celery = Celery()
\ No newline at end of file
+celery = Celery()
+redis_store = RedisStore()
\ No newline at end of file
@@ -1,6 +1,8 @@
 from datetime import datetime
 
+from bson import ObjectId
 from mongoengine.queryset import QuerySet
+from mongoengine.queryset.visitor import Q
 
 from api_service.extensions import db
 
@@ -18,12 +20,16 @@ class Timestamps(db.EmbeddedDocument):
 class PaginationCursor:
     """
     Custom pagination for 'service' deserialization. Cursor pagination type with 'next' and 'limit' options.
-    The default sorting method is to sort objects ascending by id
+    The default sorting method is to sort objects ascending by id.
+    Each page is fetched with one query limited to 'page_limit' + 1 items - the extra item shows whether
+    there is a next page (previous page for 'before' cursor) without counting remaining items.
+    Cursors contain the sort key value and id of the item, so the page is found with a seek query on
+    the compound (sort key, id) index.
     """
-    def __init__(self, iterable, after_id, before_id, page_limit, sort_by):
+    def __init__(self, iterable, after_cursor, before_cursor, page_limit, sort_by, total=None):
         self.iterable = iterable
-        self.after_id = after_id
-        self.before_id = before_id
+        self.after_cursor = after_cursor
+        self.before_cursor = before_cursor
         self.page_limit = page_limit
         if sort_by:
             if sort_by.startswith('-'):
@@ -37,41 +43,29 @@ class PaginationCursor:
             self.sort_by = 'id'
             self.sort_direction = 'ascending'
 
-        if isinstance(iterable, QuerySet):
+        if total is not None:
+            # Number of items counted (or cached) by the caller
+            self.total = total
+        elif isinstance(iterable, QuerySet):
             self.total = iterable.count()
         else:
             self.total = len(iterable)
         # Find items on current page
-        self.items = self.calculate_items_on_page()
-        try:
-            # '_last_item' on the page - necessary to determine the new 'after'
-            self._last_item = self.items[self.items_count - 1]
-            # Check whether there are any objects in db behind '_last_item'
-            query_operator = f'{self.sort_by}__gt' if self.sort_direction == 'ascending' else f'{self.sort_by}__lt'
-            items_kwargs = {
-                query_operator: getattr(self._last_item, f'{self.sort_by}')
-            }
-            self._items_count_after_last_item = len(self.iterable(**items_kwargs))
-        except IndexError:
-            self._last_item = None
-        # '_first_item' on the page - necessary to determine the new 'before'
-        self._first_item = self.items.first()
-        if self._first_item:
-            # Check whether there are any objects in db before '_firs_item'
-            query_operator = f'{self.sort_by}__lt' if self.sort_direction == 'ascending' else f'{self.sort_by}__gt'
-            items_kwargs = {
-                query_operator: getattr(self._first_item, f'{self.sort_by}')
-            }
-            self._items_count_before_first_item = len(self.iterable(**items_kwargs))
+        self.items, has_more = self.calculate_items_on_page()
+        if self.before_cursor:
+            # Page before the cursor - the cursor item itself is on the next page
+            self.has_prev, self.has_next = has_more, True
+        else:
+            # The 'after' cursor item is on the previous page
+            self.has_prev, self.has_next = bool(self.after_cursor), has_more
 
     @property
     def after(self):
         """
         Returns 'after' cursor (starting next page after this cursor).
         """
-        if self._last_item:
-            if self.items_count <= self.page_limit and self._items_count_after_last_item > 0:
-                return self._last_item
+        if self.items and self.has_next:
+            return self.items[-1]
         return None
 
     @property
@@ -79,9 +73,8 @@ class PaginationCursor:
         """
         Returns 'before' cursor (starting previous page before this cursor).
         """
-        if self._first_item:
-            if self.items_count <= self.page_limit and self._items_count_before_first_item > 0:
-                return self._first_item
+        if self.items and self.has_prev:
+            return self.items[0]
         return None
 
     @property
@@ -93,35 +86,39 @@ class PaginationCursor:
 
     def calculate_items_on_page(self):
         """
-        Returns items on current page.
+        Returns items on current page and information whether there are more items behind the page
+        (in the direction of paging).
         """
-        if self.after_id or self.before_id:
+        ascending = self.sort_direction == 'ascending'
+        if self.before_cursor:
+            # Items before the cursor are fetched in reversed sort order (nearest to the cursor first)
+            ascending = not ascending
+        # Items with the same sort key value are ordered by id
+        sort_order = [self.sort_by, 'id'] if self.sort_by != 'id' else ['id']
+        if not ascending:
+            sort_order = [f'-{field}' for field in sort_order]
+        items = self.iterable
+        cursor = self.after_cursor or self.before_cursor
+        if cursor:
             # Execute if 'after' or 'before' query param is present in URL
-            model_id = self.after_id if self.after_id else self.before_id
-            model = self.iterable(id=model_id).first()
-            if self.sort_direction == 'ascending':
-                query_operator = f'{self.sort_by}__gt' if self.after_id else f'{self.sort_by}__lt'
-                items_kwargs = {
-                    query_operator: getattr(model, f'{self.sort_by}')
-                }
-                items = self.iterable(**items_kwargs).order_by(f'{self.sort_by}')
-                if self.after_id:
-                    items = items.limit(self.page_limit)
-                else:
-                    # If 'before' query param present get last 'self.page_limit' (count) from items.
-                    if len(items) > self.page_limit:
-                        items = items.skip(len(items) - self.page_limit)
-            else:
-                query_operator = f'{self.sort_by}__lt' if self.after_id else f'{self.sort_by}__gt'
-                items_kwargs = {
-                    query_operator: getattr(model, f'{self.sort_by}')
-                }
-                items = self.iterable(**items_kwargs).order_by(f'-{self.sort_by}').limit(self.page_limit)
-        else:
-            # Execute if neither 'before' nor 'after' query params are present in URL
-            sort_order = self.sort_by if self.sort_direction == 'ascending' else f'-{self.sort_by}'
-            items = self.iterable.order_by(sort_order).limit(self.page_limit)
-        return items
+            items = items(self.seek_query(cursor, ascending))
+        items = list(items.order_by(*sort_order).limit(self.page_limit + 1))
+        has_more = len(items) > self.page_limit
+        items = items[:self.page_limit]
+        if self.before_cursor:
+            items.reverse()
+        return items, has_more
+
+    def seek_query(self, cursor, ascending):
+        """
+        Returns query selecting items behind the cursor (in the direction of paging).
+        """
+        operator = 'gt' if ascending else 'lt'
+        cursor_id = ObjectId(cursor['id'])
+        if self.sort_by == 'id':
+            return Q(**{f'id__{operator}': cursor_id})
+        value = cursor['value']
+        return Q(**{f'{self.sort_by}__{operator}': value}) | Q(**{self.sort_by: value, f'id__{operator}': cursor_id})
 
 
 class Host(db.EmbeddedDocument):
@@ -142,13 +139,38 @@ class Service(db.Document):
     proto = db.StringField(choices=('tcp', 'udp'), required=True)
     timestamps = db.EmbeddedDocumentField(document_type=Timestamps, default=Timestamps)
     status = db.StringField(choices=('up', 'down', 'unknown'), default='unknown')
+    # Check interval in seconds (used by the 'interval' watchdog schedule)
+    check_interval = db.IntField(min_value=5, max_value=86400, default=30)
+    # Time of the next check (set by the watchdog, service without 'next_check' is due immediately)
+    next_check = db.DateTimeField()
+
+    meta = {
+        'indexes': [
+            # Watchdog queries services due for check (within '_id' range of the sweep shard)
+            ('next_check', 'id'),
+            # Services pagination sorted by name (seek query on sort key and id)
+            ('name', 'id'),
+            # Services counted and filtered by status
+            ('status', 'id'),
+            # Services filtered by host value prefix
+            ('host.value', 'id'),
+            # Services not tested recently (stale status)
+            'timestamps.last_tested'
+        ],
+        # Indexes are built without blocking the collection (use 'flask indexes create' before first deploy)
+        'index_background': True
+    }
 
     @classmethod
-    def paginate_cursor(cls, **kwargs):
+    def paginate_cursor(cls, only=None, filters=None, **kwargs):
         """
         Add cursor-based pagination to Service model.
+        Items are returned as raw documents (dicts) with 'only' fields (and '_id') matching 'filters' query.
         """
-        return PaginationCursor(cls.objects, **kwargs)
+        iterable = cls.objects(**(filters or {})).as_pymongo()
+        if only:
+            iterable = iterable.only(*only)
+        return PaginationCursor(iterable, **kwargs)
 
 
 
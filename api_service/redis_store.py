@@ -0,0 +1,25 @@
+from redis import Redis
+
+
+class RedisStore:
+    """
+    Flask extension providing the Redis client (created on first use).
+    """
+    def __init__(self, app=None):
+        self._client = None
+        self.url = None
+        self.options = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.url = app.config.get('REDIS_URL')
+        self.options = app.config.get('REDIS_OPTIONS', {})
+        self._client = None
+        app.extensions['redis_store'] = self
+
+    @property
+    def client(self) -> Redis:
+        if self._client is None:
+            self._client = Redis.from_url(self.url, **self.options)
+        return self._client
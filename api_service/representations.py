@@ -0,0 +1,52 @@
+import gzip
+
+import msgpack
+import orjson
+from flask import make_response, current_app, request
+
+# Suffix of the ETag of compressed response (compressed body is a different representation)
+GZIP_ETAG_SUFFIX = '-gzip'
+
+
+def compress_response(response):
+    """
+    Compress response body with gzip if accepted by the client and the body is larger than
+    RESPONSE_COMPRESSION_MIN_SIZE (small bodies are not worth the compression time).
+    """
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    min_size = current_app.config.get('RESPONSE_COMPRESSION_MIN_SIZE')
+    if min_size is None or not request.accept_encodings['gzip'] or response.content_length < min_size:
+        return response
+    response.set_data(gzip.compress(response.get_data(),
+                                    compresslevel=current_app.config.get('RESPONSE_COMPRESSION_LEVEL', 6)))
+    response.headers['Content-Encoding'] = 'gzip'
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f'{etag}{GZIP_ETAG_SUFFIX}', weak)
+    return response
+
+
+def output_json(data, code, headers=None):
+    """
+    Makes response with compact JSON body encoded with orjson (used by default).
+    """
+    response = make_response(orjson.dumps(data), code)
+    response.headers.extend(headers or {})
+    return compress_response(response)
+
+
+def output_msgpack(data, code, headers=None):
+    """
+    Makes response with MessagePack body (requested with 'Accept: application/msgpack' header).
+    """
+    response = make_response(msgpack.packb(data, use_bin_type=True), code)
+    response.headers.extend(headers or {})
+    return compress_response(response)
+
+
+# Representations of API responses - mimetype: output function
+representations = {
+    'application/json': output_json,
+    'application/msgpack': output_msgpack,
+    'application/x-msgpack': output_msgpack
+}
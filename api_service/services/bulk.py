@@ -0,0 +1,100 @@
+import json
+from itertools import islice
+
+from marshmallow import ValidationError
+from pymongo.errors import BulkWriteError
+
+from api_service.models import Service
+from api_service.services.schemas import ServiceSchema, error_parser
+
+
+def read_ndjson(stream):
+    """
+    Returns generator of services data from NDJSON stream (one service per line, None if line is not valid JSON).
+    """
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+
+def chunks(items, chunk_size: int):
+    """
+    Returns generator of lists of (index, item) with at most 'chunk_size' items.
+    """
+    items = enumerate(items)
+    chunk = list(islice(items, chunk_size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(items, chunk_size))
+
+
+def import_services(items, chunk_size=1000) -> list:
+    """
+    Validates and inserts services in chunks. Name uniqueness is checked with one query per chunk
+    and valid services are inserted with one unordered 'insert_many'.
+    Returns list of results (with service id or error message) in order of the services in request.
+    """
+    results = []
+    # Names of services imported within the request
+    names = set()
+    # Name is checked for the whole chunk at once
+    schema = ServiceSchema(context={'check_name': False})
+    collection = Service._get_collection()
+    for chunk in chunks(items, chunk_size):
+        valid_services = []
+        for index, service_data in chunk:
+            result = {'index': index}
+            results.append(result)
+            try:
+                # Not valid JSON line (None) is rejected by the schema as invalid input type
+                service = schema.load(service_data)
+                if service['name'] in names:
+                    raise ValidationError({
+                        'name': [f'Service {service["name"]} already exists, please use a different name.']
+                    })
+            except ValidationError as error:
+                result.update({'status': 400, 'message': error_parser(error)})
+                continue
+            names.add(service['name'])
+            valid_services.append((result, service))
+        if not valid_services:
+            continue
+        existing_names = {
+            service['name'] for service in collection.find(
+                {'name': {'$in': [service['name'] for _, service in valid_services]}}, projection={'name': 1})
+        }
+        documents = []
+        for result, service in valid_services:
+            if service['name'] in existing_names:
+                result.update({'status': 400, 'message': {
+                    'name': f'Service {service["name"]} already exists, please use a different name.'
+                }})
+                continue
+            documents.append((result, Service(**service).to_mongo().to_dict()))
+        insert_documents(collection, documents)
+    return results
+
+
+def insert_documents(collection, documents: list):
+    """
+    Inserts documents with unordered 'insert_many' and updates the results of inserted services.
+    """
+    if not documents:
+        return
+    failed = {}
+    try:
+        collection.insert_many([document for _, document in documents], ordered=False)
+    except BulkWriteError as error:
+        # Service with the same name could be added by concurrent request
+        failed = {write_error['index']: write_error for write_error in error.details['writeErrors']}
+    for index, (result, document) in enumerate(documents):
+        if index in failed:
+            message = 'Service already exists, please use a different name.' if failed[index]['code'] == 11000 \
+                else failed[index]['errmsg']
+            result.update({'status': 400, 'message': {'name': message}})
+        else:
+            result.update({'status': 201, 'id': str(document['_id'])})
@@ -0,0 +1,53 @@
+import json
+
+
+class ResponseCache:
+    """
+    Class specifying the cache of API responses stored in Redis.
+    Cache keys contain version of the cached data (ETag), so cached responses are invalidated by version change
+    and expire after 'ttl' seconds. Hits, misses and bypasses are counted in Redis hash.
+    """
+    # Get cached response and count the cache hit or miss
+    GET_SCRIPT = """
+        local value = redis.call('get', KEYS[1])
+        if value then
+            redis.call('hincrby', KEYS[2], 'hits', 1)
+        else
+            redis.call('hincrby', KEYS[2], 'misses', 1)
+        end
+        return value
+    """
+
+    def __init__(self, redis, key='services:cache', ttl=30):
+        self.redis = redis
+        self.key = key
+        self.ttl = ttl
+        self.metrics_key = f'{key}:metrics'
+
+    def response_key(self, version: str) -> str:
+        return f'{self.key}:{version}'
+
+    def get(self, version: str):
+        """
+        Returns cached response data (None on cache miss).
+        """
+        value = self.redis.eval(self.GET_SCRIPT, 2, self.response_key(version), self.metrics_key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, version: str, data):
+        self.redis.set(self.response_key(version), json.dumps(data), ex=self.ttl)
+
+    def bypassed(self):
+        self.redis.hincrby(self.metrics_key, 'bypasses', 1)
+
+    def get_metrics(self) -> dict:
+        return {key.decode(): int(value) for key, value in self.redis.hgetall(self.metrics_key).items()}
+
+    def clear(self) -> int:
+        """
+        Deletes cached responses and metrics. Returns number of deleted keys.
+        """
+        keys = list(self.redis.scan_iter(match=f'{self.key}:*', count=1000))
+        if keys:
+            self.redis.delete(*keys)
+        return len(keys)
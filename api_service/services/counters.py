@@ -0,0 +1,98 @@
+import time
+
+
+class ServiceCounters:
+    """
+    Class specifying the services counter cached in Redis.
+    The counter is updated on services create/delete, recomputed from db on cache miss and expires after 'ttl'
+    seconds (limits the drift caused by changes made directly in db).
+    """
+    # Change the counter only if it is cached (missing counter is recomputed from db)
+    INCREMENT_SCRIPT = """
+        if redis.call('exists', KEYS[1]) == 1 then
+            return redis.call('incrby', KEYS[1], ARGV[1])
+        end
+        return nil
+    """
+
+    def __init__(self, redis, key='services:total', ttl=300):
+        self.redis = redis
+        self.key = key
+        self.ttl = ttl
+
+    def get_total(self, count) -> int:
+        """
+        Returns cached number of services. The 'count' function is called on cache miss.
+        """
+        total = self.redis.get(self.key)
+        if total is not None:
+            return int(total)
+        total = count()
+        self.redis.set(self.key, total, ex=self.ttl, nx=True)
+        return total
+
+    def increment(self, amount=1):
+        self.redis.eval(self.INCREMENT_SCRIPT, 1, self.key, amount)
+
+    def reset(self, total=0):
+        self.redis.set(self.key, total, ex=self.ttl)
+
+
+class ServiceVersions:
+    """
+    Class specifying the version counters of services used as ETags. The collection version is changed on any
+    change of services, the document version on change of the service. The epoch is changed on changes of all
+    services (document ETag is built from the epoch and document version).
+    Missing counter is initialized with current time (in ms), so versions are not repeated after Redis data loss.
+    Document version initialized on read expires after 'ttl' seconds (e.g. version of not existing service).
+    """
+    INCREMENT_SCRIPT = """
+        for _, key in ipairs(KEYS) do
+            redis.call('set', key, ARGV[1], 'nx')
+            redis.call('incr', key)
+        end
+        return 1
+    """
+
+    def __init__(self, redis, key='services:version', ttl=86400):
+        self.redis = redis
+        self.key = key
+        self.epoch_key = f'{key}:epoch'
+        self.ttl = ttl
+
+    def document_key(self, service_id) -> str:
+        return f'{self.key}:{service_id}'
+
+    def get(self, service_id=None) -> str:
+        """
+        Returns the document version (collection version if id is not specified).
+        """
+        if service_id is None:
+            keys = [self.key]
+            pipe = self.redis.pipeline()
+            pipe.set(self.key, self.initial_version(), nx=True)
+        else:
+            keys = [self.epoch_key, self.document_key(service_id)]
+            pipe = self.redis.pipeline()
+            pipe.set(self.epoch_key, self.initial_version(), nx=True)
+            pipe.set(self.document_key(service_id), self.initial_version(), nx=True, ex=self.ttl)
+        pipe.mget(keys)
+        versions = pipe.execute()[-1]
+        return '.'.join(version.decode() for version in versions)
+
+    def increment(self, service_ids=(), epoch=False):
+        """
+        Changes the collection version and versions of specified services (or the epoch).
+        """
+        keys = [self.key] + [self.document_key(service_id) for service_id in service_ids]
+        if epoch:
+            keys.append(self.epoch_key)
+        self.redis.eval(self.INCREMENT_SCRIPT, len(keys), *keys, self.initial_version())
+
+    def delete(self, service_id):
+        self.increment()
+        self.redis.delete(self.document_key(service_id))
+
+    @staticmethod
+    def initial_version() -> int:
+        return int(time.time() * 1000)
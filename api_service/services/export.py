@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+import zlib
+from itertools import islice
+
+from api_service.services.serializers import serialize_service, TIMESTAMP_FIELDS
+
+# Export formats - format: (mimetype, file extension)
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv')
+}
+
+
+def batches(iterable, batch_size: int):
+    """
+    Returns generator of lists with at most 'batch_size' items.
+    """
+    # Iterating over not cached queryset again rewinds it, so it is iterated only once
+    iterator = (item for item in iterable)
+    batch = list(islice(iterator, batch_size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, batch_size))
+
+
+def get_csv_header(service_fields) -> list:
+    """
+    Returns CSV columns of the service fields (nested fields are flattened, e.g. 'host.type').
+    """
+    header = []
+    for field in service_fields:
+        if field == 'host':
+            header.extend(['host.type', 'host.value'])
+        elif field == 'timestamps':
+            header.extend(f'timestamps.{timestamp}' for timestamp in TIMESTAMP_FIELDS)
+        else:
+            header.append(field)
+    return header
+
+
+def get_csv_row(service: dict) -> list:
+    """
+    Returns CSV row of the serialized service.
+    """
+    row = []
+    for field, value in service.items():
+        if field == 'host':
+            row.extend([value['type'], value['value']] if value else ['', ''])
+        elif field == 'timestamps':
+            row.extend(value.values() if value else [''] * len(TIMESTAMP_FIELDS))
+        else:
+            row.append(value)
+    return row
+
+
+def export_services(services, service_fields, export_format='ndjson', batch_size=1000, overlay=None):
+    """
+    Returns generator of exported services text chunks (one chunk per batch of db cursor).
+    Raw services are serialized batch by batch, so memory usage does not depend on number of services.
+    The 'overlay' function is called with each batch of raw services (e.g. to overlay live status).
+    """
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(get_csv_header(service_fields))
+    for batch in batches(services, batch_size):
+        if overlay:
+            overlay(batch)
+        if export_format == 'csv':
+            writer.writerows(get_csv_row(serialize_service(service, service_fields)) for service in batch)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            yield ''.join(json.dumps(serialize_service(service, service_fields), separators=(',', ':')) + '\n'
+                          for service in batch)
+    if export_format == 'csv' and buffer.tell():
+        # Header of empty export
+        yield buffer.getvalue()
+
+
+def gzip_stream(chunks, level=6):
+    """
+    Returns generator of gzip compressed text chunks.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
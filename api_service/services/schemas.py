@@ -2,10 +2,11 @@ import re
 
 from flask import current_app
 from marshmallow import Schema, fields, post_dump, pre_load, validates, ValidationError, validates_schema
-from marshmallow.validate import OneOf, Length
-from bson import objectid
+from marshmallow.validate import OneOf, Length, Range
 
 from api_service.models import Service
+from api_service.services.utils import decode_cursor
+from api_service.services.serializers import SERVICE_OUTPUT_FIELDS
 
 
 class ServiceHostSchema(Schema):
@@ -82,6 +83,8 @@ class ServiceSchema(Schema):
                                dump_only=True)
     status = fields.Str(dump_only=True,
                         validate=OneOf(choices=['up', 'down', 'unknown']))
+    check_interval = fields.Integer(validate=Range(min=5, max=86400,
+                                                   error='Not valid check interval (range 5-86400 sec).'))
 
     @pre_load
     def validate_type(self, data, **kwargs):
@@ -93,7 +96,8 @@ class ServiceSchema(Schema):
 
     @validates('name')
     def validate_name(self, name):
-        if Service.objects(name=name):
+        # Names of imported services are checked with one query per chunk ('check_name' disabled in context)
+        if self.context.get('check_name', True) and Service.objects(name=name):
             raise ValidationError(f'Service {name} already exists, please use a different name.')
 
     @validates('port')
@@ -109,29 +113,64 @@ class ServiceSchema(Schema):
         ordered = True
 
 
-class ServiceSchemaQueryParams(Schema):
+class CursorField(fields.Str):
+    """
+    Field deserializing opaque pagination cursor (signed sort key value and id) without db lookup.
+    """
+    def _deserialize(self, value, attr, data, **kwargs):
+        cursor = super()._deserialize(value, attr, data, **kwargs)
+        try:
+            return decode_cursor(cursor)
+        except ValueError as error:
+            raise ValidationError(str(error))
+
+
+class FieldsField(fields.Str):
+    """
+    Field deserializing comma separated service fields (sparse fieldset) to tuple in the output order.
+    """
+    def _deserialize(self, value, attr, data, **kwargs):
+        value = super()._deserialize(value, attr, data, **kwargs)
+        service_fields = set(value.split(','))
+        if not service_fields.issubset(SERVICE_OUTPUT_FIELDS):
+            raise ValidationError(f'Not valid fields. Use comma separated fields: {", ".join(SERVICE_OUTPUT_FIELDS)}.')
+        return tuple(field for field in SERVICE_OUTPUT_FIELDS if field in service_fields)
+
+
+class ServiceSchemaFieldsParams(Schema):
+    """
+    The schema for deserializing 'service' fields query param.
+    """
+    # Schema 'fields' attribute is reserved
+    service_fields = FieldsField(data_key='fields')
+
+
+class ServiceSchemaFiltersParams(ServiceSchemaFieldsParams):
+    """
+    The schema for deserializing 'service' fields and filters query params.
+    """
+    status = fields.Str(validate=OneOf(choices=['up', 'down', 'unknown'],
+                                       error='Not valid status. Use up, down or unknown.'))
+    proto = fields.Str(validate=OneOf(choices=['tcp', 'udp'],
+                                      error='Not valid protocol. Use tcp or udp.'))
+    host_type = fields.Str(data_key='host.type',
+                           validate=OneOf(choices=['hostname', 'ip'],
+                                          error='Not valid host type (use ip or hostname).'))
+    # Prefix of the host value
+    host_value = fields.Str(data_key='host.value',
+                            validate=Length(min=1, max=30))
+    port = fields.Str(validate=Length(min=1, max=8))
+
+
+class ServiceSchemaQueryParams(ServiceSchemaFiltersParams):
     """
     The schema for deserializing 'service' query params.
     """
-    after = fields.Str()
-    before = fields.Str()
+    after = CursorField()
+    before = CursorField()
     limit = fields.Integer()
     sort=fields.Str()
 
-    @validates('after')
-    def validate_after(self, after_id):
-        if not after_id or not objectid.ObjectId.is_valid(after_id):
-            raise ValidationError('Not valid cursor')
-        if not Service.objects(id=after_id):
-            raise ValidationError(f'Cursor with id {after_id} does not exist.')
-
-    @validates('before')
-    def validate_before(self, before_id):
-        if not before_id or not objectid.ObjectId.is_valid(before_id):
-            raise ValidationError('Not valid cursor.')
-        if not Service.objects(id=before_id):
-            raise ValidationError(f'Cursor with id {before_id} does not exist.')
-
     @validates('limit')
     def validate_limit(self, limit):
         limit_max = current_app.config.get('MAX_PAGINATION_LIMIT')
@@ -140,7 +179,6 @@ class ServiceSchemaQueryParams(Schema):
 
     @validates('sort')
     def validate_sort(self, value):
-        print(value)
         if not value or value not in ['name', '-name', 'id', '-id']:
             raise ValidationError('Not valid sort value. Use one of the following values: name, -name, id or -id.')
 
@@ -150,66 +188,21 @@ class ServiceSchemaQueryParams(Schema):
             raise ValidationError('before and after cannot be used together', 'query_params.')
         return data
 
-
-class PagingLinksSchema(Schema):
-    """
-    The schema perform the serialization of paginate URLs.
-    The schema is used as nested field in 'PagingSchema'.
-    """
-    previous = fields.Url(dump_only=True)
-    next = fields.Url(dump_only=True)
-
-    class Meta:
-        ordered = True
-
-
-class PagingCursorsSchema(Schema):
-    """
-    The schema perform the serialization of cursors data.
-    The schema used as nested field in 'PagingSchema'.
-    """
-    before = fields.Str(dump_only=True)
-    after = fields.Str(dump_only=True)
-
-    class Meta:
-        ordered = True
-
-
-class PagingSchema(Schema):
-    """
-    The schema perform the serialization of pagination data.
-    The schema used as nested field in 'ServicesSchema'.
-    """
-    limit = fields.Integer(dump_only=True)
-    cursors = fields.Nested(PagingCursorsSchema())
-    links = fields.Nested(PagingLinksSchema())
-
-    class Meta:
-        ordered = True
-
-
-class ServicesDataSchema(Schema):
-    """
-    The schema perform the serialization of services data.
-    The schema used as nested field in 'ServicesSchema'.
-    """
-    services_total = fields.Integer(dump_only=True)
-    services_up = fields.Integer(dump_only=True)
-    services = fields.List(fields.Nested(ServiceSchema))
-
-    class Meta:
-        ordered = True
+    @validates_schema
+    def validate_cursor_sort(self, data, **kwargs):
+        sort_field = data.get('sort', '').lstrip('-') or 'id'
+        for cursor_name in ('after', 'before'):
+            cursor = data.get(cursor_name)
+            if cursor and cursor['sort'] != sort_field:
+                raise ValidationError('Cursor does not match sort order.', cursor_name)
 
 
-class ServicesSchema(Schema):
+class ServiceSchemaExportParams(ServiceSchemaFiltersParams):
     """
-    The schema for serializing 'services' and paging info.
+    The schema for deserializing 'services export' query params.
     """
-    paging = fields.Nested(PagingSchema())
-    data = fields.Nested(ServicesDataSchema)
-
-    class Meta:
-        ordered = True
+    format = fields.Str(validate=OneOf(choices=['ndjson', 'csv'],
+                                       error='Not valid format. Use ndjson or csv.'))
 
 
 class WatchdogSchema(Schema):
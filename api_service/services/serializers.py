@@ -0,0 +1,49 @@
+# Service document fields returned by the API
+SERVICE_FIELDS = ('name', 'host', 'proto', 'port', 'timestamps', 'status', 'check_interval')
+TIMESTAMP_FIELDS = ('last_responded', 'last_tested', 'created', 'edited')
+# Fields of the serialized service (in output order)
+SERVICE_OUTPUT_FIELDS = ('id',) + SERVICE_FIELDS
+# Defaults of the 'Service' model fields (applied by mongoengine when document is loaded)
+SERVICE_DEFAULTS = {
+    'status': 'unknown',
+    'check_interval': 30
+}
+
+
+def serialize_timestamps(timestamps: dict) -> dict:
+    """
+    Returns timestamps in ISO 8601 format (empty string if not set).
+    """
+    result = {}
+    for field in TIMESTAMP_FIELDS:
+        value = timestamps.get(field)
+        result[field] = value.isoformat() if value is not None else ''
+    return result
+
+
+def serialize_host(host: dict) -> dict:
+    return {'type': host.get('type'), 'value': host.get('value')}
+
+
+def serialize_field(service: dict, field: str):
+    """
+    Returns serialized value of the raw service document field.
+    """
+    if field == 'id':
+        return str(service['_id'])
+    value = service.get(field, SERVICE_DEFAULTS.get(field))
+    if value is None:
+        return None
+    if field == 'host':
+        return serialize_host(value)
+    if field == 'timestamps':
+        return serialize_timestamps(value)
+    return value
+
+
+def serialize_service(service: dict, fields=SERVICE_OUTPUT_FIELDS) -> dict:
+    """
+    Returns serialized raw service document (dict returned by 'as_pymongo') with specified fields.
+    The output is identical to 'ServiceSchema' dump of the 'Service' document, without document hydration.
+    """
+    return {field: serialize_field(service, field) for field in fields}
@@ -1,11 +1,33 @@
-from flask import current_app
+import hashlib
+from datetime import datetime
+
+from flask import current_app, request, Response
 from flask_restful import abort
 from bson import objectid
-from redis.exceptions import ConnectionError as RedisConnectionError
+from pymongo import ReturnDocument
+from itsdangerous import URLSafeSerializer, BadSignature
+from redis.exceptions import ConnectionError as RedisConnectionError, RedisError
 
-from api_service.extensions import api
+from api_service.extensions import api, redis_store
+from api_service.representations import GZIP_ETAG_SUFFIX
 from api_service.models import Service
 from api_service.watchdog_celery.monitoring import WatchdogEntry
+from api_service.watchdog_celery.lease import SweepMetrics
+from api_service.watchdog_celery.live_status import LiveStatusStore
+from api_service.services.counters import ServiceCounters, ServiceVersions
+from api_service.services.cache import ResponseCache
+from api_service.services.serializers import serialize_service, SERVICE_FIELDS, SERVICE_OUTPUT_FIELDS
+
+
+# Services list filters - deserialized query param: (query param name, mongoengine query)
+SERVICE_FILTERS = {
+    'status': ('status', 'status'),
+    'proto': ('proto', 'proto'),
+    'host_type': ('host.type', 'host__type'),
+    # Host value is matched by prefix (anchored regex can use the index)
+    'host_value': ('host.value', 'host__value__startswith'),
+    'port': ('port', 'port')
+}
 
 
 def set_services_query_params(data_query_params):
@@ -14,17 +36,43 @@ def set_services_query_params(data_query_params):
     """
     page_limit_default = current_app.config.get('DEFAULT_PAGINATION_LIMIT')
     query_params = {
-        'after_id': data_query_params.get('after', ''),
-        'before_id': data_query_params.get('before', ''),
+        'after_cursor': data_query_params.get('after'),
+        'before_cursor': data_query_params.get('before'),
         'page_limit': data_query_params.get('limit', page_limit_default),
         'sort_by': data_query_params.get('sort', '')
     }
     return query_params
 
 
-def get_services_to_dump(resource, services, query_params):
+def set_services_filters(data_query_params):
+    """
+    Set services list filters for ServicesApi resource.
+    """
+    return {field: value for field, value in data_query_params.items() if field in SERVICE_FILTERS}
+
+
+def get_filters_query(filters):
+    """
+    Return mongoengine query of the services list filters.
+    """
+    return {SERVICE_FILTERS[field][1]: value for field, value in filters.items()}
+
+
+def get_services_projection(service_fields, sort_by=''):
+    """
+    Return document fields read from db for the serialized service fields (and the sort key of cursors).
+    """
+    sort_field = sort_by.lstrip('-')
+    only = [field for field in service_fields if field in SERVICE_FIELDS]
+    if sort_field in SERVICE_FIELDS and sort_field not in only:
+        only.append(sort_field)
+    # Only '_id' is read if no other field is needed
+    return tuple(only) or ('id',)
+
+
+def get_services_to_dump(resource, services, query_params, filters=None, service_fields=SERVICE_OUTPUT_FIELDS):
     """
-    Prepare services data to dump for ServicesApi resource.
+    Serialize services (raw documents) with paging info for ServicesApi resource.
     """
     page_limit = query_params.get('page_limit')
     sort_by = query_params.get('sort_by')
@@ -38,15 +86,20 @@ def get_services_to_dump(resource, services, query_params):
         }
         if sort_by:
             url_kwargs['sort'] = sort_by
+        # Cursors are valid within the filtered services
+        for field, value in (filters or {}).items():
+            url_kwargs[SERVICE_FILTERS[field][0]] = value
+        if service_fields != SERVICE_OUTPUT_FIELDS:
+            url_kwargs['fields'] = ','.join(service_fields)
         if services.after:
             # Get next page url and cursor after
-            next_url = api.url_for(**url_kwargs, after=services.after.id)
-            cursor_after = str(services.after.id)
+            cursor_after = encode_cursor(services.after, sort_by)
+            next_url = api.url_for(**url_kwargs, after=cursor_after)
         if services.before:
             # Get prev page url and cursor before
-            url_prev = api.url_for(**url_kwargs, before=services.before.id)
-            cursor_before = str(services.before.id)
-    services_count_up = Service.objects(status='up').count()
+            cursor_before = encode_cursor(services.before, sort_by)
+            url_prev = api.url_for(**url_kwargs, before=cursor_before)
+    services_count_up = count_services_up()
     paging = {
         'limit': page_limit,
         'cursors': {
@@ -61,7 +114,7 @@ def get_services_to_dump(resource, services, query_params):
     data = {
         'services_total': services.total,
         'services_up': services_count_up,
-        'services': services.items,
+        'services': [serialize_service(service, service_fields) for service in services.items],
     }
     services_to_dump = {
         'paging': paging,
@@ -70,6 +123,269 @@ def get_services_to_dump(resource, services, query_params):
     return services_to_dump
 
 
+def get_cursor_serializer():
+    """
+    Return serializer signing the pagination cursors (cursors can not be forged by the client).
+    """
+    return URLSafeSerializer(current_app.config.get('SECRET_KEY'), salt='services-cursor')
+
+
+def encode_cursor(service, sort_by):
+    """
+    Return opaque pagination cursor with the (raw) service sort key value and id.
+    """
+    sort_field = sort_by.lstrip('-') or 'id'
+    cursor = {'sort': sort_field, 'id': str(service['_id'])}
+    if sort_field != 'id':
+        cursor['value'] = service[sort_field]
+    return get_cursor_serializer().dumps(cursor)
+
+
+def decode_cursor(cursor):
+    """
+    Return pagination cursor data (sort field, sort key value and service id).
+    Raises ValueError if the cursor is not valid.
+    """
+    try:
+        data = get_cursor_serializer().loads(cursor)
+    except BadSignature:
+        raise ValueError('Not valid cursor.')
+    if not isinstance(data, dict) or not objectid.ObjectId.is_valid(data.get('id')):
+        raise ValueError('Not valid cursor.')
+    if data.get('sort') != 'id' and 'value' not in data:
+        raise ValueError('Not valid cursor.')
+    return data
+
+
+def get_service_counters():
+    """
+    Return services counters cached in Redis (the key contains db name - db can share Redis with other app).
+    """
+    return ServiceCounters(redis_store.client,
+                           key=f'services:total:{Service._get_db().name}',
+                           ttl=current_app.config.get('SERVICES_COUNT_TTL'))
+
+
+def count_services_total(filters=None):
+    """
+    Return number of services. Depending on SERVICES_COUNT_MODE the number is counted in db ('exact'),
+    read from the counter cached in Redis ('cached') or estimated from collection metadata ('estimated').
+    Filtered services are always counted in db.
+    """
+    if filters:
+        return Service.objects(**get_filters_query(filters)).count()
+    count_mode = current_app.config.get('SERVICES_COUNT_MODE')
+    if count_mode == 'estimated':
+        return Service._get_collection().estimated_document_count()
+    if count_mode == 'cached':
+        try:
+            return get_service_counters().get_total(Service.objects.count)
+        except RedisError as error:
+            current_app.logger.error(f'Error: {error} in count_services_total')
+    return Service.objects.count()
+
+
+def change_services_total(amount=None):
+    """
+    Change the cached number of services by amount (reset the counter to 0 if amount is not specified).
+    """
+    if current_app.config.get('SERVICES_COUNT_MODE') != 'cached':
+        return
+    try:
+        if amount is None:
+            get_service_counters().reset()
+        else:
+            get_service_counters().increment(amount)
+    except RedisError as error:
+        current_app.logger.error(f'Error: {error} in change_services_total')
+
+
+def get_service_versions():
+    """
+    Return version counters of services (the key contains db name - db can share Redis with other app).
+    """
+    return ServiceVersions(redis_store.client, key=f'services:version:{Service._get_db().name}')
+
+
+def get_response_mimetype():
+    """
+    Return mimetype of the response representation negotiated with 'Accept' request header (as flask-restful does).
+    """
+    return request.accept_mimetypes.best_match(api.representations, default=api.default_mediatype)
+
+
+def get_etag(service_id=None):
+    """
+    Return strong ETag of the service or of the services list with request query params and response mimetype.
+    Return None if Redis is not available.
+    """
+    try:
+        version = get_service_versions().get(service_id)
+    except RedisError as error:
+        current_app.logger.error(f'Error: {error} in get_etag')
+        return None
+    # Representation depends on query params (e.g. filters and fields)
+    query_params = '&'.join(f'{key}={value}' for key, value in sorted(request.args.items(multi=True)))
+    if service_id is None:
+        version = f'services:{version}?{query_params}'
+    else:
+        version = f'service:{service_id}:{version}?{query_params}'
+    version = f'{version}:{get_response_mimetype()}'
+    return hashlib.sha1(version.encode()).hexdigest()
+
+
+def etag_headers(etag):
+    """
+    Return response headers with ETag (empty if ETag is not available).
+    """
+    return {'ETag': f'"{etag}"'} if etag else {}
+
+
+def not_modified_response(etag):
+    """
+    Return '304 Not Modified' response if ETag matches 'If-None-Match' request header (None otherwise).
+    ETag of gzip compressed response has a suffix.
+    """
+    if not etag:
+        return None
+    for etag_variant in (etag, f'{etag}{GZIP_ETAG_SUFFIX}'):
+        if request.if_none_match.contains(etag_variant):
+            response = Response(status=304, headers=etag_headers(etag_variant))
+            response.vary.update(('Accept', 'Accept-Encoding'))
+            return response
+    return None
+
+
+def get_response_cache():
+    """
+    Return cache of services pages (None if disabled in app config).
+    """
+    cache_ttl = current_app.config.get('SERVICES_CACHE_TTL')
+    if not cache_ttl:
+        return None
+    return ResponseCache(redis_store.client, key=f'services:cache:{Service._get_db().name}', ttl=cache_ttl)
+
+
+def get_cached_services(etag):
+    """
+    Return cache status ('HIT', 'MISS', 'BYPASS' or None if cache is not used) and cached services page.
+    The cache is bypassed with 'Cache-Control: no-cache' request header.
+    """
+    response_cache = get_response_cache()
+    if not response_cache or not etag:
+        return None, None
+    try:
+        if request.cache_control.no_cache:
+            response_cache.bypassed()
+            return 'BYPASS', None
+        # Page links contain the request host
+        dumped_services = response_cache.get(f'{etag}:{request.host}')
+    except RedisError as error:
+        current_app.logger.error(f'Error: {error} in get_cached_services')
+        return None, None
+    return ('HIT', dumped_services) if dumped_services is not None else ('MISS', None)
+
+
+def cache_services(etag, dumped_services):
+    """
+    Store services page in cache.
+    """
+    response_cache = get_response_cache()
+    if not response_cache or not etag:
+        return
+    try:
+        response_cache.set(f'{etag}:{request.host}', dumped_services)
+    except RedisError as error:
+        current_app.logger.error(f'Error: {error} in cache_services')
+
+
+def response_headers(etag, cache_status=None):
+    """
+    Return response headers with ETag and cache status.
+    """
+    headers = etag_headers(etag)
+    if cache_status:
+        headers['X-Cache'] = cache_status
+    return headers
+
+
+def change_service_versions(service_id=None, deleted=False, epoch=False):
+    """
+    Change versions (ETags) of services list and the service (or all services if 'epoch' is set).
+    """
+    try:
+        service_versions = get_service_versions()
+        if deleted:
+            service_versions.delete(service_id)
+        else:
+            service_versions.increment([service_id] if service_id else (), epoch=epoch)
+    except RedisError as error:
+        current_app.logger.error(f'Error: {error} in change_service_versions')
+
+
+def get_live_status_store():
+    """
+    Return live status store (None if disabled in app config).
+    """
+    if not current_app.config.get('WATCHDOG_LIVE_STATUS'):
+        return None
+    return LiveStatusStore(redis_store.client, key=f'watchdog:live:{Service._get_db().name}')
+
+
+def overlay_live_status(services, service_fields=SERVICE_OUTPUT_FIELDS):
+    """
+    Overlay status and timestamps of (raw) services with live values kept by the watchdog in Redis.
+    Values stored in db are used if Redis is not available (or the serialized fields do not contain live values).
+    """
+    live_store = get_live_status_store()
+    if not live_store or not {'status', 'timestamps'}.intersection(service_fields):
+        return services
+    try:
+        entries = live_store.get_many([service['_id'] for service in services])
+    except RedisError as error:
+        current_app.logger.error(f'Error: {error} in overlay_live_status')
+        return services
+    for service in services:
+        entry = entries.get(str(service['_id']))
+        if entry:
+            service['status'] = entry['status']
+            timestamps = service.setdefault('timestamps', {})
+            if entry['last_tested']:
+                timestamps['last_tested'] = entry['last_tested']
+            if entry['last_responded']:
+                timestamps['last_responded'] = entry['last_responded']
+    return services
+
+
+def count_services_up():
+    """
+    Return number of services with 'up' status (from live status store if available).
+    """
+    live_store = get_live_status_store()
+    if live_store:
+        try:
+            return live_store.count_up()
+        except RedisError as error:
+            current_app.logger.error(f'Error: {error} in count_services_up')
+    return Service.objects(status='up').count()
+
+
+def delete_live_status(service_id=None):
+    """
+    Delete live status of the service (all services if id is not specified).
+    """
+    live_store = get_live_status_store()
+    if not live_store:
+        return
+    try:
+        if service_id:
+            live_store.delete(service_id)
+        else:
+            live_store.clear()
+    except RedisError as error:
+        current_app.logger.error(f'Error: {error} in delete_live_status')
+
+
 def check_mongo_id(service_id):
     """
     Check whether id is 24-character hex string (compliant with the MongoDB '_id' field).
@@ -78,6 +394,44 @@ def check_mongo_id(service_id):
         abort(400, message='The specified service id is invalid.', status=400)
 
 
+def get_raw_service(service_id, only=SERVICE_FIELDS):
+    """
+    Return raw service document (dict) with specified id and 'only' fields or 404.
+    """
+    service = Service.objects(id=service_id).only(*only).as_pymongo().first()
+    if not service:
+        abort(404, message=f'Service with id {service_id} does not exist.', status=404)
+    return service
+
+
+def get_service_update(data: dict) -> dict:
+    """
+    Return '$set' update of the service fields specified in deserialized request data.
+    """
+    update = {field: data[field] for field in ('name', 'proto', 'port', 'check_interval') if data.get(field)}
+    for field, value in data.get('host', {}).items():
+        if value:
+            update[f'host.{field}'] = value
+    return update
+
+
+def update_service(service_id, update: dict):
+    """
+    Update service with single 'find_one_and_update' and return updated raw service document or 404.
+    Name uniqueness is enforced by the unique index ('DuplicateKeyError' is raised for existing name).
+    """
+    update['timestamps.edited'] = datetime.utcnow()
+    # Edited service is checked in the next sweep
+    update['next_check'] = None
+    service = Service._get_collection().find_one_and_update({'_id': objectid.ObjectId(service_id)},
+                                                            {'$set': update},
+                                                            projection=SERVICE_FIELDS,
+                                                            return_document=ReturnDocument.AFTER)
+    if not service:
+        abort(404, message=f'Service with id {service_id} does not exist.', status=404)
+    return service
+
+
 def check_service_exist(service_id):
     """
     Check whether service with specified id exists in database.
@@ -98,3 +452,12 @@ def get_watchdog_job():
         abort(503, message='Watchdog service unavailable.', status=503)
     return watchdog_job
 
+
+def get_watchdog_metrics():
+    """
+    Return watchdog sweep metrics (empty if Redis is not available).
+    """
+    try:
+        return SweepMetrics(redis_store.client).get()
+    except RedisError:
+        return {}
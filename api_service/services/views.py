@@ -1,26 +1,48 @@
-from datetime import datetime
-from uuid import uuid4
+from itertools import islice
 
-from flask import Blueprint, request
+from flask import Blueprint, request, current_app, Response, stream_with_context
 from flask_restful import Resource
 from marshmallow import ValidationError
+from pymongo.errors import DuplicateKeyError
 from flasgger import swag_from
 
 from api_service.models import Service
 from api_service.services.schemas import (
     ServiceSchema,
     ServiceSchemaQueryParams,
-    ServicesSchema,
+    ServiceSchemaFieldsParams,
+    ServiceSchemaExportParams,
     error_parser,
     WatchdogSchema
 )
 from api_service.services.utils import (
     set_services_query_params,
+    set_services_filters,
+    get_filters_query,
     get_services_to_dump,
+    get_services_projection,
     check_mongo_id,
     check_service_exist,
-    get_watchdog_job
+    get_service_update,
+    update_service,
+    get_watchdog_job,
+    get_watchdog_metrics,
+    overlay_live_status,
+    delete_live_status,
+    count_services_total,
+    change_services_total,
+    get_raw_service,
+    get_etag,
+    etag_headers,
+    not_modified_response,
+    change_service_versions,
+    get_cached_services,
+    cache_services,
+    response_headers
 )
+from api_service.services.serializers import serialize_service, SERVICE_OUTPUT_FIELDS
+from api_service.services.bulk import read_ndjson, import_services
+from api_service.services.export import export_services, gzip_stream, EXPORT_FORMATS
 
 serv_bp = Blueprint('serv_bp', __name__)
 
@@ -42,16 +64,30 @@ class ServicesApi(Resource):
                 return {'message': errors_custom, 'status': 400}, 400
         else:
             data_query_params = {}
+        # Return '304 Not Modified' if services have not changed
+        etag = get_etag()
+        response = not_modified_response(etag)
+        if response:
+            return response
+        # Return cached page if services have not changed (cache key contains ETag)
+        cache_status, dumped_services = get_cached_services(etag)
+        if dumped_services is not None:
+            return dumped_services, 200, response_headers(etag, cache_status)
         # Set query params
         query_params = set_services_query_params(data_query_params)
         # Get services with custom pagination
-        services = Service.paginate_cursor(**query_params)
-        # Prepare data to dump
-        services_to_dump = get_services_to_dump(resource=ServicesApi, services=services, query_params=query_params)
-        # Serialize services with paging info
-        schema = ServicesSchema()
-        dumped_services = schema.dump(services_to_dump)
-        return dumped_services, 200
+        filters = set_services_filters(data_query_params)
+        # Only fields of the sparse fieldset are read from db
+        service_fields = data_query_params.get('service_fields', SERVICE_OUTPUT_FIELDS)
+        only = get_services_projection(service_fields, query_params['sort_by'])
+        services = Service.paginate_cursor(only=only, filters=get_filters_query(filters), **query_params,
+                                           total=count_services_total(filters))
+        overlay_live_status(services.items, service_fields)
+        # Serialize services (raw documents) with paging info
+        dumped_services = get_services_to_dump(resource=ServicesApi, services=services, query_params=query_params,
+                                               filters=filters, service_fields=service_fields)
+        cache_services(etag, dumped_services)
+        return dumped_services, 200, response_headers(etag, cache_status)
 
     @swag_from("swagger/services_post.yml")
     def post(self):
@@ -67,6 +103,8 @@ class ServicesApi(Resource):
             errors_custom = error_parser(error)
             return {'message': errors_custom, 'status': 400}, 400
         service = Service(**result).save()
+        change_services_total(1)
+        change_service_versions()
         return {'id': str(service.id)}, 201, {'Location': f'{request.base_url}/{str(service.id)}'}
 
     @swag_from("swagger/services_delete.yml")
@@ -75,9 +113,69 @@ class ServicesApi(Resource):
         Delete all services from db.
         """
         Service.objects().all().delete()
+        change_services_total()
+        change_service_versions(epoch=True)
+        delete_live_status()
         return {'message': 'All services deleted'}, 200
 
 
+class ServicesBulkApi(Resource):
+    @swag_from("swagger/services_bulk_post.yml")
+    def post(self):
+        """
+        Add multiple services to db (JSON array or NDJSON).
+        """
+        max_items = current_app.config['SERVICES_BULK_MAX_ITEMS']
+        if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            request_data = list(islice(read_ndjson(request.stream), max_items + 1))
+        else:
+            request_data = request.get_json(silent=True)
+            if not isinstance(request_data, list):
+                return {'message': {'services': 'Invalid input type (use JSON array or NDJSON).'}, 'status': 400}, 400
+        if len(request_data) > max_items:
+            return {'message': f'Too many services in request (max {max_items}).', 'status': 413}, 413
+        results = import_services(request_data, chunk_size=current_app.config['SERVICES_BULK_CHUNK_SIZE'])
+        created = sum(1 for result in results if result['status'] == 201)
+        if created:
+            change_services_total(created)
+            change_service_versions()
+        failed = len(results) - created
+        # '207 Multi-Status' if only some of the services were created
+        status = 207 if created and failed else 201 if created else 400
+        return {'created': created, 'failed': failed, 'services': results}, status
+
+
+class ServicesExportApi(Resource):
+    @swag_from("swagger/services_export_get.yml")
+    def get(self):
+        """
+        Stream all (filtered) services as NDJSON or CSV.
+        """
+        try:
+            data_query_params = ServiceSchemaExportParams().load(request.args)
+        except ValidationError as error:
+            # Custom error output
+            errors_custom = error_parser(error)
+            return {'message': errors_custom, 'status': 400}, 400
+        export_format = data_query_params.get('format', 'ndjson')
+        service_fields = data_query_params.get('service_fields', SERVICE_OUTPUT_FIELDS)
+        batch_size = current_app.config['SERVICES_EXPORT_BATCH_SIZE']
+        # Services are read with single db cursor (without cursor cache)
+        services = Service.objects(**get_filters_query(set_services_filters(data_query_params))) \
+            .only(*get_services_projection(service_fields)).as_pymongo().no_cache().batch_size(batch_size)
+        chunks = export_services(services, service_fields, export_format, batch_size,
+                                 overlay=lambda batch: overlay_live_status(batch, service_fields))
+        mimetype, extension = EXPORT_FORMATS[export_format]
+        headers = {
+            'Content-Disposition': f'attachment; filename=services.{extension}',
+            'Vary': 'Accept-Encoding'
+        }
+        if request.accept_encodings['gzip']:
+            chunks = gzip_stream(chunks)
+            headers['Content-Encoding'] = 'gzip'
+        return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
+
+
 class ServiceApi(Resource):
     @swag_from("swagger/service_get.yml")
     def get(self, service_id):
@@ -85,10 +183,22 @@ class ServiceApi(Resource):
         Retrieve detailed information on the selected service.
         """
         check_mongo_id(service_id)
-        service = check_service_exist(service_id)
-        schema = ServiceSchema()
-        dumped_service = schema.dump(service)
-        return {'service': dumped_service}, 200
+        try:
+            data_query_params = ServiceSchemaFieldsParams().load(request.args)
+        except ValidationError as error:
+            # Custom error output
+            errors_custom = error_parser(error)
+            return {'message': errors_custom, 'status': 400}, 400
+        # Return '304 Not Modified' if service has not changed
+        etag = get_etag(service_id)
+        response = not_modified_response(etag)
+        if response:
+            return response
+        service_fields = data_query_params.get('service_fields', SERVICE_OUTPUT_FIELDS)
+        service = get_raw_service(service_id, only=get_services_projection(service_fields))
+        overlay_live_status([service], service_fields)
+        dumped_service = serialize_service(service, service_fields)
+        return {'service': dumped_service}, 200, etag_headers(etag)
 
     @swag_from("swagger/service_put.yml")
     def put(self, service_id):
@@ -97,31 +207,7 @@ class ServiceApi(Resource):
         Full update to an existing resource.
         """
         check_mongo_id(service_id)
-        service = check_service_exist(service_id)
-        request_data = request.get_json()
-        schema = ServiceSchema()
-        try:
-            if service.name == request_data.get('name'):
-                # If same 'name' in request and db - use a dummy name to omit same name and no data validation.
-                request_data['name'] = uuid4().hex
-                result = schema.load(request_data)
-                result['name'] = service.name
-            else:
-                result = schema.load(request_data)
-        except ValidationError as error:
-            # Custom error output
-            errors_custom = error_parser(error)
-            return {'message': errors_custom, 'status': 400}, 400
-        # Update MongoDB document
-        service.name = result['name']
-        service.host.type = result['host']['type']
-        service.host.value = result['host']['value']
-        service.proto = result['proto']
-        service.port = result['port']
-        service.timestamps.edited = datetime.utcnow()
-        service.save()
-        dumped_service = schema.dump(service)
-        return {'service': dumped_service}, 200
+        return self.update(service_id)
 
     @swag_from("swagger/service_patch.yml")
     def patch(self, service_id):
@@ -130,35 +216,32 @@ class ServiceApi(Resource):
         Partial update to an existing resource.
         """
         check_mongo_id(service_id)
-        service = check_service_exist(service_id)
-        schema = ServiceSchema()
-        request_data = request.get_json()
+        return self.update(service_id, partial=('name', 'host', 'port', 'proto', 'check_interval'))
+
+    @staticmethod
+    def update(service_id, partial=False):
+        """
+        Validate request data and update the service with single db request.
+        """
+        # Name uniqueness is checked by db unique index on update
+        schema = ServiceSchema(context={'check_name': False})
+        request_data = request.get_json(silent=True)
         try:
-            if service.name == request_data.get('name'):
-                # If same 'name' in request and db - use a dummy name to omit same name and no data validation.
-                request_data['name'] = uuid4().hex
-                result = schema.load(request_data, partial=('name', 'host', 'port', 'proto'))
-                result['name'] = service.name
-            else:
-                result = schema.load(request_data, partial=('name', 'host', 'port', 'proto'))
+            result = schema.load(request_data, partial=partial)
         except ValidationError as error:
+            # Not existing service is reported before data errors
+            check_service_exist(service_id)
             # Custom error output
             errors_custom = error_parser(error)
             return {'message': errors_custom, 'status': 400}, 400
-        if result.get('name'):
-            service.name = result['name']
-        if result.get('host'):
-            if result['host']['type']:
-                service.host.type = result['host']['type']
-            if result['host']['value']:
-                service.host.value = result['host']['value']
-        if result.get('port'):
-            service.port = result['port']
-        if result.get('proto'):
-            service.proto = result['proto']
-        service.timestamps.edited = datetime.utcnow()
-        service.save()
-        dumped_service = schema.dump(service)
+        try:
+            service = update_service(service_id, get_service_update(result))
+        except DuplicateKeyError:
+            errors_custom = {'name': f'Service {result["name"]} already exists, please use a different name.'}
+            return {'message': errors_custom, 'status': 400}, 400
+        change_service_versions(service_id)
+        overlay_live_status([service])
+        dumped_service = serialize_service(service)
         return {'service': dumped_service}, 200
 
     @swag_from("swagger/service_delete.yml")
@@ -169,6 +252,9 @@ class ServiceApi(Resource):
         check_mongo_id(service_id)
         service = check_service_exist(service_id)
         service.delete()
+        change_services_total(-1)
+        change_service_versions(service_id, deleted=True)
+        delete_live_status(service_id)
         return {'message': f'Service with id {service_id} deleted.'}, 200
 
 
@@ -179,10 +265,8 @@ class WatchdogApi(Resource):
         Return information whether the watchdog service is running.
         """
         watchdog_job = get_watchdog_job()
-        if watchdog_job.enabled:
-            return {'watchdog_status': 'up'}, 200
-        else:
-            return {'watchdog_status': 'down'}, 200
+        watchdog_status = 'up' if watchdog_job.enabled else 'down'
+        return {'watchdog_status': watchdog_status, 'metrics': get_watchdog_metrics()}, 200
 
     @swag_from("swagger/watchdog_post.yml")
     def post(self):
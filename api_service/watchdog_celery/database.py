@@ -0,0 +1,56 @@
+from threading import Lock
+
+from pymongo import MongoClient
+from pymongo.uri_parser import parse_uri
+from celery.signals import worker_process_init, worker_process_shutdown, worker_shutdown
+from flask import current_app
+
+
+# MongoClient shared by all tasks of the worker process
+_client = None
+_client_lock = Lock()
+
+
+def get_mongo_db_name():
+    """
+    Get database name directly from the MongoDB URI.
+    """
+    mongodb_uri = current_app.config.get('MONGODB_SETTINGS')['host']
+    # When you use MongoClient with 'host' parameter, the database name in URI is being ignored.
+    mongodb_db_name = parse_uri(mongodb_uri)['database']
+    return mongodb_uri, mongodb_db_name
+
+
+def get_mongo_db():
+    """
+    Returns database from MongoDB URI using the process-wide pooled MongoClient (created on first use).
+    """
+    global _client
+    mongodb_uri, mongodb_db_name = get_mongo_db_name()
+    with _client_lock:
+        if _client is None:
+            # Pool size and timeouts are set in app config
+            _client = MongoClient(host=mongodb_uri, **current_app.config.get('WATCHDOG_MONGO_CLIENT', {}))
+    return _client[mongodb_db_name]
+
+
+@worker_process_init.connect
+def reset_mongo_client(**kwargs):
+    """
+    MongoClient is not fork-safe - the forked worker process creates its own client.
+    """
+    global _client
+    _client = None
+
+
+@worker_process_shutdown.connect
+@worker_shutdown.connect
+def close_mongo_client(**kwargs):
+    """
+    Closes MongoClient on worker (process) shutdown.
+    """
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
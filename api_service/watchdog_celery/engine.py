@@ -0,0 +1,124 @@
+import asyncio
+import socket
+from contextlib import asynccontextmanager
+
+from flask import current_app
+
+from api_service.watchdog_celery.resolver import DnsCache
+from api_service.watchdog_celery.scheduler import ProbeScheduler
+from api_service.watchdog_celery.udp import UdpProber, udp_state_up
+
+
+class AsyncProbeEngine:
+    """
+    Class specifying the probe engine that checks services concurrently on a single asyncio event loop.
+    TCP ports are checked with a native non-blocking connect(), so no process or thread is spawned per service.
+    """
+    def __init__(self, timeout=2, udp_sockets=4, scheduler=None, dns_cache=None, udp_no_response_up=True):
+        self.timeout = timeout
+        self.udp_sockets = udp_sockets
+        # UDP port without response ('open|filtered') is treated as service response
+        self.udp_no_response_up = udp_no_response_up
+        # Scheduler limiting the number of in-flight probes
+        self.scheduler = scheduler or ProbeScheduler()
+        # DNS cache shared between sweeps
+        self.dns_cache = dns_cache or DnsCache(timeout=timeout)
+        self.udp_prober = None
+
+    def run(self, services: list) -> list:
+        """
+        Checks all services and returns list of (service, response) tuples (in any order).
+        The response is None if the service hostname could not be resolved.
+        """
+        return asyncio.run(self.check_services(services))
+
+    async def check_services(self, services: list) -> list:
+        """
+        Checks all services concurrently in one probe session.
+        """
+        async with self.session():
+            return await self.check_batch(services)
+
+    @asynccontextmanager
+    async def session(self):
+        """
+        Probe session - UDP probes share one prober (a few multiplexed sockets).
+        """
+        async with UdpProber(timeout=self.timeout, sockets_count=self.udp_sockets) as self.udp_prober:
+            yield self
+
+    async def check_batch(self, services: list) -> list:
+        """
+        Checks services concurrently (within the probe session). Each distinct hostname is resolved once per batch.
+        Services sharing the same (ip, port, proto) endpoint are probed once and the result is fanned out to all
+        of them.
+        """
+        hostnames = list({service['host']['value'] for service in services if service['host']['type'] == 'hostname'})
+        ip_addresses = await asyncio.gather(*[self.resolve(hostname) for hostname in hostnames])
+        resolved = dict(zip(hostnames, ip_addresses))
+        results = []
+        # (ip, port, proto) -> services
+        endpoints = {}
+        for service in services:
+            current_app.logger.info(f'Started checking the "{service["name"]}" service')
+            host_type, host_value = service['host']['type'], service['host']['value']
+            # Check host type and use ip resolved from hostname if needed.
+            if host_type == 'hostname':
+                host_value = resolved[host_value]
+                if not host_value:
+                    results.append((service, None))
+                    continue
+            endpoint = (host_value, int(service['port']), service['proto'])
+            endpoints.setdefault(endpoint, []).append(service)
+        responses = await asyncio.gather(*[self.check_endpoint(*endpoint) for endpoint in endpoints])
+        for endpoint_services, response in zip(endpoints.values(), responses):
+            results.extend((service, response) for service in endpoint_services)
+        return results
+
+    async def resolve(self, hostname: str) -> str:
+        """
+        Resolves hostname (cached or in a probe slot - each DNS query opens a socket, so the queries are limited
+        by the scheduler as well as the probes).
+        """
+        ip = self.dns_cache.get(hostname)
+        if ip is not None:
+            return ip
+        async with self.scheduler.slot(hostname):
+            return await self.dns_cache.resolve_async(hostname)
+
+    async def check_endpoint(self, ip_address: str, port: int, proto: str) -> bool:
+        """
+        Checks the status of a particular endpoint.
+        """
+        async with self.scheduler.slot(ip_address):
+            return await self.port_status(proto, ip_address, port)
+
+    async def port_status(self, proto: str, ip_address: str, port) -> bool:
+        """
+        Check whether host is listening on specified port.
+        """
+        if proto == 'tcp':
+            return await self.tcp_status(ip_address, port)
+        return await self.udp_status(ip_address, port)
+
+    async def tcp_status(self, ip_address: str, port) -> bool:
+        """
+        Check TCP port with non-blocking connect() on the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            await asyncio.wait_for(loop.sock_connect(sock, (ip_address, int(port))), timeout=self.timeout)
+            return True
+        except (OSError, asyncio.TimeoutError):
+            return False
+        finally:
+            sock.close()
+
+    async def udp_status(self, ip_address: str, port) -> bool:
+        """
+        Check UDP port with the native UDP prober.
+        """
+        state = await self.udp_prober.probe(ip_address, port)
+        return udp_state_up(state, self.udp_no_response_up)
@@ -0,0 +1,78 @@
+from uuid import uuid4
+
+
+class SweepLease:
+    """
+    Class specifying the Redis lease lock held for the time of the watchdog sweep.
+    The lease expires after 'ttl' seconds, so a crashed sweep does not block next sweeps.
+    """
+    # Delete the key only if the lease is still held by the token owner
+    RELEASE_SCRIPT = """
+        if redis.call('get', KEYS[1]) == ARGV[1] then
+            return redis.call('del', KEYS[1])
+        end
+        return 0
+    """
+
+    def __init__(self, redis, key='watchdog:sweep:lease', ttl=300):
+        self.redis = redis
+        self.key = key
+        self.ttl = ttl
+        # Set if the sweep was requested while the lease was held (coalesced into one follow-up sweep)
+        self.pending_key = f'{key}:pending'
+
+    def acquire(self):
+        """
+        Returns lease token or None if the lease is held by another sweep.
+        """
+        token = uuid4().hex
+        if self.redis.set(self.key, token, nx=True, ex=self.ttl):
+            return token
+        return None
+
+    def release(self, token: str) -> bool:
+        return bool(self.redis.eval(self.RELEASE_SCRIPT, 1, self.key, token))
+
+    def mark_pending(self):
+        self.redis.set(self.pending_key, 1, ex=self.ttl)
+
+    def pop_pending(self) -> bool:
+        """
+        Returns True (and clears the flag) if a sweep was requested while the lease was held.
+        """
+        pipe = self.redis.pipeline()
+        pipe.get(self.pending_key)
+        pipe.delete(self.pending_key)
+        pending, _ = pipe.execute()
+        return bool(pending)
+
+
+class SweepMetrics:
+    """
+    Class specifying the watchdog sweep metrics stored in Redis hash.
+    """
+    def __init__(self, redis, key='watchdog:metrics'):
+        self.redis = redis
+        self.key = key
+
+    def skipped(self):
+        self.redis.hincrby(self.key, 'skipped_runs', 1)
+
+    def completed(self, duration: float, interval: int):
+        pipe = self.redis.pipeline()
+        pipe.hincrby(self.key, 'completed_runs', 1)
+        pipe.hset(self.key, 'last_sweep_duration', round(duration, 3))
+        if duration > interval:
+            pipe.hincrby(self.key, 'overrun_runs', 1)
+            pipe.hset(self.key, 'last_overrun', round(duration - interval, 3))
+        pipe.execute()
+
+    def get(self) -> dict:
+        """
+        Returns metrics - run counters ('*_runs') and durations in seconds.
+        """
+        metrics = {}
+        for key, value in self.redis.hgetall(self.key).items():
+            key = key.decode()
+            metrics[key] = int(value) if key.endswith('_runs') else float(value)
+        return metrics
@@ -0,0 +1,72 @@
+import json
+from datetime import datetime
+
+
+class LiveStatusStore:
+    """
+    Class specifying the live status of services kept in Redis by the watchdog.
+    Entries (status, last tested/responded time and time of the last db checkpoint) are stored in one Redis hash,
+    ids of services with 'up' status are stored in a Redis set.
+    The key should contain db name (db can share Redis with other app or watchdog).
+    """
+    TIME_FIELDS = ('last_tested', 'last_responded', 'checkpoint')
+
+    def __init__(self, redis, key='watchdog:live'):
+        self.redis = redis
+        self.key = key
+        self.up_key = f'{key}:status:up'
+
+    def get_many(self, service_ids: list) -> dict:
+        """
+        Returns live entries of specified services (services without entry are omitted).
+        """
+        if not service_ids:
+            return {}
+        service_ids = [str(service_id) for service_id in service_ids]
+        values = self.redis.hmget(self.key, service_ids)
+        return {service_id: self.load(value) for service_id, value in zip(service_ids, values) if value}
+
+    def get_all(self) -> dict:
+        return {service_id.decode(): self.load(value) for service_id, value in self.redis.hgetall(self.key).items()}
+
+    def set_many(self, entries: dict):
+        """
+        Stores live entries and updates the set of services with 'up' status.
+        """
+        if not entries:
+            return
+        pipe = self.redis.pipeline()
+        pipe.hset(self.key, mapping={service_id: self.dump(entry) for service_id, entry in entries.items()})
+        up_ids = [service_id for service_id, entry in entries.items() if entry['status'] == 'up']
+        down_ids = [service_id for service_id, entry in entries.items() if entry['status'] != 'up']
+        if up_ids:
+            pipe.sadd(self.up_key, *up_ids)
+        if down_ids:
+            pipe.srem(self.up_key, *down_ids)
+        pipe.execute()
+
+    def delete(self, service_id):
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.key, str(service_id))
+        pipe.srem(self.up_key, str(service_id))
+        pipe.execute()
+
+    def clear(self):
+        self.redis.delete(self.key, self.up_key)
+
+    def count_up(self) -> int:
+        return self.redis.scard(self.up_key)
+
+    def dump(self, entry: dict) -> str:
+        entry = {
+            key: value.isoformat() if key in self.TIME_FIELDS and value else value
+            for key, value in entry.items()
+        }
+        return json.dumps(entry)
+
+    def load(self, value: bytes) -> dict:
+        entry = json.loads(value)
+        for key in self.TIME_FIELDS:
+            if entry.get(key):
+                entry[key] = datetime.fromisoformat(entry[key])
+        return entry
@@ -1,98 +1,259 @@
-import sys
+import asyncio
 import subprocess
-from datetime import datetime
-import socket
-from threading import Thread
+from datetime import datetime, timedelta
+from threading import Thread, BoundedSemaphore
 from uuid import uuid4
 
 from redbeat import RedBeatSchedulerEntry
 from flask import current_app
 
-from api_service.extensions import celery
+from api_service.extensions import celery, redis_store
+from api_service.watchdog_celery.engine import AsyncProbeEngine
+from api_service.watchdog_celery.resolver import get_dns_cache
+from api_service.watchdog_celery.scheduler import ProbeScheduler, IntervalScheduler
+from api_service.watchdog_celery.udp import udp_port_state, udp_state_up
+from api_service.watchdog_celery.writer import StatusWriter
+from api_service.watchdog_celery.sweeps import due_query
+from api_service.watchdog_celery.live_status import LiveStatusStore
+from api_service.services.counters import ServiceVersions
+
+
+# File descriptors used by one probe in the 'thread' mode - 'nc' subprocess pipes (stdout, stderr and exec
+# error pipe) or the UDP probe event loop (epoll, self-pipe pair and socket)
+THREAD_PROBE_FDS = 4
+
+# Service fields used by the watchdog
+SERVICE_PROJECTION = {
+    'name': 1,
+    'host': 1,
+    'port': 1,
+    'proto': 1,
+    'status': 1,
+    'check_interval': 1,
+    'next_check': 1
+}
 
 
 class MonitoringService:
     """
     Class specifying the object responsible for checking the status of monitored services.
     """
-    def __init__(self, db, timer=10):
+    def __init__(self, db, timer=10, mode='thread', schedule='sweep', query=None):
+        # Duration (in sec) of the 'interval' schedule run
         self.timer = timer
         self.db = db
+        # Watchdog mode - 'thread' (thread per service) or 'asyncio' (single event loop)
+        self.mode = mode
+        # Watchdog schedule - 'sweep' (all services checked at once) or 'interval' (services checked when due)
+        self.schedule = schedule
+        # Scheduler limiting the number of in-flight probes (the 'interval' schedule always uses asyncio engine)
+        thread_probes = mode == 'thread' and schedule != 'interval'
+        self.scheduler = ProbeScheduler(max_in_flight=current_app.config.get('WATCHDOG_MAX_IN_FLIGHT', 512),
+                                        max_per_host=current_app.config.get('WATCHDOG_MAX_PER_HOST', 8),
+                                        reserved_fds=current_app.config.get('WATCHDOG_RESERVED_FDS', 64),
+                                        fds_per_probe=THREAD_PROBE_FDS if thread_probes else 1)
         # Service collection
         self.service_collection = self.db.service
+        # Filter of services checked by this watchdog (e.g. '_id' range of the sweep shard)
+        self.query = query or {}
+        # Probe results are written to the live status store (Redis) and back to db in batches
+        live_store = None
+        if current_app.config.get('WATCHDOG_LIVE_STATUS'):
+            live_store = LiveStatusStore(redis_store.client, key=f'watchdog:live:{db.name}')
+        self.writer = StatusWriter(self.service_collection,
+                                   batch_size=current_app.config.get('WATCHDOG_BULK_BATCH_SIZE', 500),
+                                   write_concern=current_app.config.get('WATCHDOG_BULK_WRITE_CONCERN'),
+                                   live_store=live_store,
+                                   checkpoint_interval=current_app.config.get('WATCHDOG_CHECKPOINT_INTERVAL', 300),
+                                   versions=ServiceVersions(redis_store.client, key=f'services:version:{db.name}'))
+
+    def start(self) -> int:
+        """
+        Starts a watchdog service. Depending on the mode each service is being tested in a separate thread
+        or all services are tested concurrently on one asyncio event loop.
+        With the 'interval' schedule services are tested (with asyncio engine) when they are due.
+        Only services due for check (indexed 'next_check' field) are read from db.
+        Returns number of tested services.
+        """
+        # Next checks of the sweep are computed from its start (the sweep duration does not delay them)
+        started = datetime.utcnow()
+        services = list(self.service_collection.find(self.get_query(), projection=SERVICE_PROJECTION))
+        # Checks if there are any due services in the collection
+        if services:
+            if self.schedule == 'interval':
+                self.start_interval(services)
+            elif self.mode == 'asyncio':
+                self.start_async(services, started)
+            else:
+                self.start_threads(services, started)
+            self.writer.flush()
+        else:
+            current_app.logger.info('No service documents due for check in the db')
+        return len(services)
 
-    def start(self):
+    def get_query(self) -> dict:
         """
-        Starts a watchdog service. Each service is being tested in a separate thread.
+        Returns the query selecting services due for check (within 'timer' for the 'interval' schedule).
         """
-        services = self.service_collection.find()
-        # Checks if there are any documents in the collection
-        if self.service_collection.count_documents({}):
-            for service in services:
-                status_thread = WatchdogThread(target=self.check_service_status,
-                                               kwargs={'service': service},
-                                               daemon=True,
-                                               name=f'service-{uuid4().hex}')
-                status_thread.start()
+        if self.schedule == 'interval':
+            ahead = self.timer
         else:
-            current_app.logger.info('No service documents in the db')
+            ahead = current_app.config.get('WATCHDOG_NEXT_CHECK_SLACK', 0)
+        query = due_query(ahead)
+        if self.query:
+            query = {'$and': [self.query, query]}
+        return query
+
+    def start_threads(self, services, started=None):
+        """
+        Tests each service in a separate thread. Number of running threads is limited by the scheduler
+        (probes of the same host are limited in the threads).
+        """
+        slots = BoundedSemaphore(self.scheduler.max_in_flight)
+        status_threads = []
+        for service in services:
+            slots.acquire()
+            status_thread = WatchdogThread(target=self.check_service_status_in_slot,
+                                           kwargs={'service': service, 'slots': slots, 'started': started},
+                                           daemon=True,
+                                           name=f'service-{uuid4().hex}')
+            status_thread.start()
+            status_threads.append(status_thread)
+        # Wait for all results before the writer is flushed
+        for status_thread in status_threads:
+            status_thread.join()
 
-    def check_service_status(self, service: dict):
+    def start_async(self, services, started=None):
+        """
+        Tests all services with the asyncio probe engine.
+        """
+        engine = self.create_engine()
+        for service, response in engine.run(services):
+            self.update_service_status(service, response, started)
+
+    def start_interval(self, services):
+        """
+        Tests each service when it is due (according to its 'check_interval') for 'timer' seconds.
+        """
+        asyncio.run(self.run_interval(services))
+
+    async def run_interval(self, services: list):
+        loop = asyncio.get_running_loop()
+        engine = self.create_engine()
+        app = current_app._get_current_object()
+
+        def flush():
+            # The writer logs errors with the app logger (executor thread has no app context)
+            with app.app_context():
+                self.writer.flush()
+
+        async def check(batch):
+            for service, response in await engine.check_batch(batch):
+                self.update_service_status(service, response)
+            await loop.run_in_executor(None, flush)
+
+        scheduler = IntervalScheduler(check, default_interval=self.default_interval)
+        # Services without 'next_check' are due immediately
+        now = datetime.utcnow()
+        for service in services:
+            delay = 0
+            if service.get('next_check'):
+                delay = max((service['next_check'] - now).total_seconds(), 0)
+            scheduler.schedule(service, loop.time() + delay)
+        async with engine.session():
+            await scheduler.run(self.timer)
+
+    @property
+    def default_interval(self) -> int:
+        return current_app.config.get('WATCHDOG_CHECK_INTERVAL', 30)
+
+    def create_engine(self) -> AsyncProbeEngine:
+        return AsyncProbeEngine(timeout=current_app.config.get('WATCHDOG_PROBE_TIMEOUT', 2),
+                                udp_sockets=current_app.config.get('WATCHDOG_UDP_SOCKETS', 4),
+                                scheduler=self.scheduler,
+                                dns_cache=get_dns_cache(),
+                                udp_no_response_up=current_app.config.get('WATCHDOG_UDP_NO_RESPONSE_UP', True))
+
+    def check_service_status_in_slot(self, service: dict, slots: BoundedSemaphore, started=None):
+        """
+        Checks the status of a particular service and releases the thread slot.
+        """
+        try:
+            self.check_service_status(service, started)
+        finally:
+            slots.release()
+
+    def check_service_status(self, service: dict, started=None):
         """
         Checks the status of a particular service. The function is started in thread with Flask app context.
         """
         host_type, host_value = service['host']['type'], service['host']['value']
         service_port, service_protocol = service['port'], service['proto']
-        service_name = service['name']
-        # Get mongodb id ('_id') of current service
-        service_id = service['_id']
-        # Service will be updated using MongoDB id ('_id')
-        service_to_update = {'_id': service_id}
-
-        current_app.logger.info(f'Started checking the "{service_name}" service')
+        current_app.logger.info(f'Started checking the "{service["name"]}" service')
         # Check host type and resolve hostname to ip if needed.
         if host_type == 'hostname':
             host_value = self.resolve_hostname(host_value)
             if not host_value:
-                # Change service 'status' if 'up'
-                if service['status'] in ['up', 'unknown']:
-                    # Update service status to 'False' (update db document)
-                    self.service_collection.update_one(service_to_update, {'$set': {'status': 'down'}})
-                # Close thread if problem with resolving occurred.
-                sys.exit()
-        # Check port status
-        response = self.port_status(service_protocol, host_value, service_port)
+                self.update_service_status(service, None, started)
+                return
+        # Check port status (waits for a free slot of the host)
+        try:
+            with self.scheduler.thread_slot(host_value):
+                response = self.port_status(service_protocol, host_value, service_port)
+        except OSError as error:
+            # E.g. no free file descriptors - service is marked as down
+            current_app.logger.error(f'Error: {error} in checking the "{service["name"]}" service')
+            response = False
+        self.update_service_status(service, response, started)
+
+    def update_service_status(self, service: dict, response, started=None):
+        """
+        Adds the result of the check to the writer (one combined update per service).
+        The response is None if the service hostname could not be resolved.
+        The 'next_check' is computed from the sweep start time ('started') or from the check time.
+        Status transitions are always persisted to db. The 'next_check' must be persisted only if the service
+        'check_interval' is longer than the sweep interval (otherwise the service is due in every sweep).
+        """
+        service_name = service['name']
+        tested = datetime.utcnow()
+        check_interval = service.get('check_interval') or self.default_interval
+        # Next check after service 'check_interval'
+        next_check = (started or tested) + timedelta(seconds=check_interval)
+        persist = check_interval > self.default_interval
+        if response is None:
+            update = {'next_check': next_check}
+            # Change service 'status' if 'up'
+            if service['status'] in ['up', 'unknown']:
+                # Update service status to 'down'
+                update['status'] = 'down'
+                service['status'] = 'down'
+                persist = True
+            self.writer.add(service['_id'], update, status=service['status'], persist=persist)
+            return
+        # Mark service as tested
+        update = {'timestamps.last_tested': tested, 'next_check': next_check}
         if response:
             # Mark service as responded
-            response_time_update = {'$set': {'timestamps.last_responded': datetime.utcnow()}}
-            self.service_collection.update_one(service_to_update, response_time_update)
+            update['timestamps.last_responded'] = update['timestamps.last_tested']
             service_status = 'up'
         else:
             service_status = 'down'
-        # Mark service as tested
-        tested_time_update = {'$set': {'timestamps.last_tested': datetime.utcnow()}}
-        self.service_collection.update_one(service_to_update, tested_time_update)
-
-        # Update service in db only if 'status' is changed
+        # Update service status only if 'status' is changed
         if service_status != service['status']:
-            status_new_value = {'$set': {'status': service_status}}
-            # Update service status (update db document)
-            self.service_collection.update_one(service_to_update, status_new_value)
+            update['status'] = service_status
+            service['status'] = service_status
+            persist = True
             current_app.logger.info(f'The "{service_name}" changed status to '
                                     f'{"UP" if service_status == "up" else "DOWN"}')
+        self.writer.add(service['_id'], update, status=service_status, persist=persist)
         current_app.logger.info(f'The "{service_name}" service is {"UP" if service_status == "up" else "DOWN"}')
 
     @staticmethod
     def resolve_hostname(hostname: str) -> str:
         """
-        Performs DNS query if host is not an ip address.
+        Performs DNS query (or returns cached result) if host is not an ip address.
         """
-        try:
-            ip = socket.gethostbyname(hostname)
-            return ip
-        except socket.gaierror as err:
-            current_app.logger.error(f'{hostname}: {err.strerror}')
-            return ''
+        return get_dns_cache().resolve(hostname)
 
     @staticmethod
     def port_status(proto: str, ip_address: str, port: str) -> str:
@@ -104,9 +265,8 @@ class MonitoringService:
             response = subprocess.run(args=options, capture_output=True, text=True)
             return True if response.returncode == 0 else False
         else:
-            options = ['sudo', 'nmap', '-sU', '-p', port, '-oG', '-', ip_address]
-            response = subprocess.run(args=options, capture_output=True, text=True)
-            return True if f'{port}/open' in response.stdout else False
+            state = udp_port_state(ip_address, port, timeout=current_app.config.get('WATCHDOG_PROBE_TIMEOUT', 2))
+            return udp_state_up(state, current_app.config.get('WATCHDOG_UDP_NO_RESPONSE_UP', True))
 
 
 class WatchdogEntry:
@@ -0,0 +1,125 @@
+import asyncio
+import socket
+import time
+from threading import Lock
+
+import dns.asyncresolver
+import dns.exception
+import dns.resolver
+from flask import current_app
+
+
+class DnsCache:
+    """
+    Class specifying the TTL-aware DNS resolution cache shared by all watchdog sweeps in the worker process.
+    Positive answers are cached for the record TTL (clamped to 'min_ttl' - 'max_ttl'), unresolvable hostnames
+    (NXDOMAIN, no answer, timeout) are cached for 'negative_ttl'.
+    """
+    def __init__(self, timeout=2, min_ttl=5, max_ttl=3600, negative_ttl=60, default_ttl=60):
+        self.timeout = timeout
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.negative_ttl = negative_ttl
+        # TTL for addresses resolved by the system resolver (e.g. from /etc/hosts)
+        self.default_ttl = default_ttl
+        # hostname -> (ip address or '', expiration time)
+        self._entries = {}
+        self._lock = Lock()
+
+    def get(self, hostname: str):
+        """
+        Returns cached ip address ('' for negative entry) or None if there is no valid entry.
+        """
+        with self._lock:
+            entry = self._entries.get(hostname)
+            if entry is None:
+                return None
+            ip, expires = entry
+            if expires < time.monotonic():
+                del self._entries[hostname]
+                return None
+            return ip
+
+    def set(self, hostname: str, ip: str, ttl: int):
+        """
+        Stores the resolution result.
+        """
+        if ip:
+            ttl = min(max(ttl, self.min_ttl), self.max_ttl)
+        else:
+            ttl = self.negative_ttl
+        with self._lock:
+            self._entries[hostname] = (ip, time.monotonic() + ttl)
+
+    async def resolve_async(self, hostname: str) -> str:
+        """
+        Resolves hostname to ip address without blocking the event loop. Returns '' if hostname is unresolvable.
+        """
+        ip = self.get(hostname)
+        if ip is not None:
+            return ip
+        ip, ttl = '', self.negative_ttl
+        try:
+            answer = await dns.asyncresolver.resolve(hostname, 'A', lifetime=self.timeout)
+            ip, ttl = answer[0].address, answer.rrset.ttl
+        except dns.exception.Timeout:
+            current_app.logger.error(f'{hostname}: DNS query timed out')
+        except dns.exception.DNSException:
+            # Not in DNS - try system resolver (hosts file, search domains)
+            ip, ttl = await self.resolve_system_async(hostname), self.default_ttl
+        self.set(hostname, ip, ttl)
+        return ip
+
+    def resolve(self, hostname: str) -> str:
+        """
+        Resolves hostname to ip address (blocking call). Returns '' if hostname is unresolvable.
+        """
+        ip = self.get(hostname)
+        if ip is not None:
+            return ip
+        ip, ttl = '', self.negative_ttl
+        try:
+            answer = dns.resolver.resolve(hostname, 'A', lifetime=self.timeout)
+            ip, ttl = answer[0].address, answer.rrset.ttl
+        except dns.exception.Timeout:
+            current_app.logger.error(f'{hostname}: DNS query timed out')
+        except dns.exception.DNSException:
+            # Not in DNS - try system resolver (hosts file, search domains)
+            ip, ttl = self.resolve_system(hostname), self.default_ttl
+        self.set(hostname, ip, ttl)
+        return ip
+
+    @staticmethod
+    async def resolve_system_async(hostname: str) -> str:
+        loop = asyncio.get_running_loop()
+        try:
+            addresses = await loop.getaddrinfo(hostname, None, family=socket.AF_INET, type=socket.SOCK_STREAM)
+            return addresses[0][4][0]
+        except socket.gaierror as err:
+            current_app.logger.error(f'{hostname}: {err.strerror}')
+            return ''
+
+    @staticmethod
+    def resolve_system(hostname: str) -> str:
+        try:
+            return socket.gethostbyname(hostname)
+        except socket.gaierror as err:
+            current_app.logger.error(f'{hostname}: {err.strerror}')
+            return ''
+
+
+_dns_cache = None
+
+
+def get_dns_cache() -> DnsCache:
+    """
+    Returns DNS cache shared by the worker process (created with the app config on first use).
+    """
+    global _dns_cache
+    if _dns_cache is None:
+        _dns_cache = DnsCache(timeout=current_app.config.get('WATCHDOG_PROBE_TIMEOUT', 2),
+                              min_ttl=current_app.config.get('WATCHDOG_DNS_MIN_TTL', 5),
+                              max_ttl=current_app.config.get('WATCHDOG_DNS_MAX_TTL', 3600),
+                              negative_ttl=current_app.config.get('WATCHDOG_DNS_NEGATIVE_TTL', 60),
+                              default_ttl=current_app.config.get('WATCHDOG_DNS_DEFAULT_TTL', 60))
+    return _dns_cache
@@ -0,0 +1,116 @@
+import asyncio
+import heapq
+from collections import defaultdict
+from contextlib import asynccontextmanager, contextmanager
+from itertools import count
+from threading import BoundedSemaphore, Lock
+
+try:
+    import resource
+except ImportError:
+    # The 'resource' module is not available on Windows
+    resource = None
+
+
+def fd_limit(reserved_fds=64):
+    """
+    Returns number of file descriptors available for probes (soft RLIMIT_NOFILE minus reserved descriptors).
+    Returns None if the limit is unknown or unlimited.
+    """
+    if resource is None:
+        return None
+    soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft_limit == resource.RLIM_INFINITY:
+        return None
+    return max(soft_limit - reserved_fds, 1)
+
+
+class ProbeScheduler:
+    """
+    Class specifying the probe scheduler. Limits the number of in-flight probes (globally and per destination
+    host). The global limit is automatically capped by the process RLIMIT_NOFILE divided by the number of file
+    descriptors used by one probe.
+    Probes running on the event loop use 'slot', probes running in threads use 'thread_slot' (the global limit
+    of threads is the number of started threads).
+    """
+    def __init__(self, max_in_flight=512, max_per_host=8, reserved_fds=64, fds_per_probe=1):
+        available_fds = fd_limit(reserved_fds)
+        if available_fds is not None:
+            max_in_flight = min(max_in_flight, max(available_fds // fds_per_probe, 1))
+        self.max_in_flight = max_in_flight
+        self.max_per_host = max(min(max_per_host, max_in_flight), 1)
+        # Semaphores are created lazily - they must be bound to the running event loop
+        self._semaphore = None
+        self._host_semaphores = None
+        self._thread_host_semaphores = defaultdict(lambda: BoundedSemaphore(self.max_per_host))
+        self._thread_lock = Lock()
+
+    @asynccontextmanager
+    async def slot(self, host: str):
+        """
+        Waits for a free probe slot for the specified destination host.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+            self._host_semaphores = defaultdict(lambda: asyncio.Semaphore(self.max_per_host))
+        async with self._host_semaphores[host]:
+            async with self._semaphore:
+                yield
+
+    @contextmanager
+    def thread_slot(self, host: str):
+        """
+        Waits for a free probe slot for the specified destination host (blocks the calling thread).
+        """
+        with self._thread_lock:
+            semaphore = self._thread_host_semaphores[host]
+        with semaphore:
+            yield
+
+
+class IntervalScheduler:
+    """
+    Class specifying the scheduler probing each service when it is due. Services are kept in a priority queue
+    (heap) ordered by due time and rescheduled with their own 'check_interval' after each check.
+    """
+    def __init__(self, check, default_interval=30):
+        # Coroutine function checking the list of due services
+        self.check = check
+        self.default_interval = default_interval
+        self._heap = []
+        # Tie-breaker for services with the same due time
+        self._counter = count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def schedule(self, service: dict, due: float):
+        """
+        Schedules the service check at 'due' (event loop time).
+        """
+        heapq.heappush(self._heap, (due, next(self._counter), service))
+
+    def interval(self, service: dict) -> int:
+        return service.get('check_interval') or self.default_interval
+
+    async def run(self, duration: float):
+        """
+        Checks due services for 'duration' seconds. Batches of due services are checked concurrently,
+        so a slow batch does not delay the next one.
+        """
+        loop = asyncio.get_running_loop()
+        end = loop.time() + duration
+        checks = []
+        while self._heap and self._heap[0][0] <= end:
+            delay = self._heap[0][0] - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            now = loop.time()
+            batch = []
+            while self._heap and self._heap[0][0] <= now:
+                due, _, service = heapq.heappop(self._heap)
+                batch.append(service)
+                # Reschedule relatively to due time to avoid drift
+                self.schedule(service, max(due + self.interval(service), now))
+            checks.append(asyncio.ensure_future(self.check(batch)))
+        await asyncio.gather(*checks)
@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+# TTL index removing sweep records after the retention period
+SWEEP_TTL_INDEX = 'finished_ttl'
+
+
+def due_query(ahead=0) -> dict:
+    """
+    Returns the query selecting services due for check within 'ahead' seconds (services without 'next_check'
+    have never been checked). The query uses the 'next_check' index.
+    """
+    due_time = datetime.utcnow() + timedelta(seconds=ahead)
+    return {'$or': [{'next_check': {'$lte': due_time}}, {'next_check': None}]}
+
+
+def get_shard_ranges(collection, shards: int, query=None) -> list:
+    """
+    Splits the services selected by query into (at most) 'shards' ranges of '_id' with similar number of documents.
+    Returns list of (id_min, id_max) tuples (ids as strings). The 'id_max' is exclusive except the last range.
+    """
+    pipeline = [
+        {'$match': query or {}},
+        {'$project': {'_id': 1}},
+        {'$bucketAuto': {'groupBy': '$_id', 'buckets': shards}}
+    ]
+    return [(str(bucket['_id']['min']), str(bucket['_id']['max'])) for bucket in collection.aggregate(pipeline)]
+
+
+def shard_query(id_min: str, id_max: str, last: bool) -> dict:
+    """
+    Returns the query selecting services in the shard range.
+    """
+    return {'_id': {'$gte': ObjectId(id_min), '$lte' if last else '$lt': ObjectId(id_max)}}
+
+
+def record_sweep(db, sweep_id: str, started: datetime, shards: list):
+    """
+    Records sweep completion with per-shard timing (empty sweeps are not stored).
+    """
+    finished = datetime.utcnow()
+    sweep = {
+        '_id': sweep_id,
+        'started': started,
+        'finished': finished,
+        'duration': (finished - started).total_seconds(),
+        'services': sum(shard['services'] for shard in shards),
+        'shards': sorted(shards, key=lambda shard: shard['shard'])
+    }
+    if sweep['services']:
+        db.watchdog_sweep.insert_one(sweep)
+    return sweep
+
+
+def get_sweep_retention(db):
+    """
+    Returns retention (in sec) of the sweep records or None if the TTL index does not exist.
+    """
+    index = db.watchdog_sweep.index_information().get(SWEEP_TTL_INDEX)
+    return index.get('expireAfterSeconds') if index else None
+
+
+def ensure_sweep_retention(db, retention: int) -> bool:
+    """
+    Creates the TTL index removing sweep records 'retention' seconds after the sweep finished (or changes
+    the retention of the existing index). Returns True if the index was created or changed.
+    """
+    current_retention = get_sweep_retention(db)
+    if current_retention == retention:
+        return False
+    if current_retention is None:
+        db.watchdog_sweep.create_index('finished', name=SWEEP_TTL_INDEX, expireAfterSeconds=retention)
+    else:
+        db.command('collMod', 'watchdog_sweep',
+                   index={'name': SWEEP_TTL_INDEX, 'expireAfterSeconds': retention})
+    return True
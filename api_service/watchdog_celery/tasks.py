@@ -1,38 +1,190 @@
-from pymongo import MongoClient, errors
-from pymongo.uri_parser import parse_uri
+import time
+from datetime import datetime
+from uuid import uuid4
+
+from bson import ObjectId
+from celery import chord
+from pymongo import errors, UpdateOne
 from flask import current_app
-from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import ConnectionError as RedisConnectionError, RedisError
 
 from api_service.watchdog_celery.monitoring import MonitoringService
-from api_service.extensions import celery
+from api_service.extensions import celery, redis_store
 from api_service.watchdog_celery.monitoring import WatchdogEntry
+from api_service.watchdog_celery.database import get_mongo_db
+from api_service.watchdog_celery.sweeps import get_shard_ranges, shard_query, record_sweep, due_query
+from api_service.watchdog_celery.lease import SweepLease, SweepMetrics
+from api_service.watchdog_celery.live_status import LiveStatusStore
+from api_service.services.counters import ServiceVersions
+
+
+def get_monitoring_service(db, query=None):
+    """
+    Returns MonitoringService configured with app config.
+    """
+    # The 'interval' schedule run ends before next 'watchdog_task' is triggered
+    timer = current_app.config.get('WATCHDOG_CHECK_INTERVAL') - current_app.config.get('WATCHDOG_PROBE_TIMEOUT')
+    return MonitoringService(db,
+                             timer=timer,
+                             mode=current_app.config.get('WATCHDOG_MODE'),
+                             schedule=current_app.config.get('WATCHDOG_SCHEDULE'),
+                             query=query)
+
+
+def get_sweep_lease():
+    """
+    Returns the lease lock of the watchdog sweep.
+    """
+    return SweepLease(redis_store.client, ttl=current_app.config.get('WATCHDOG_SWEEP_LEASE_TTL'))
 
 
-def get_mongo_db_name():
+def complete_sweep(db, sweep_id, started, shards, token):
     """
-    Get database name directly from the MongoDB URI.
+    Records the sweep and its metrics, releases the sweep lease and starts coalesced sweep if requested.
     """
-    mongodb_uri = current_app.config.get('MONGODB_SETTINGS')['host']
-    # When you use MongoClient with 'host' parameter, the database name in URI is being ignored.
-    mongodb_db_name = parse_uri(mongodb_uri)['database']
-    return mongodb_uri, mongodb_db_name
+    try:
+        sweep = record_sweep(db, sweep_id, started, shards)
+        SweepMetrics(redis_store.client).completed(sweep['duration'],
+                                                   current_app.config.get('WATCHDOG_CHECK_INTERVAL'))
+    finally:
+        release_sweep(sweep_id, token)
+    return sweep
+
+
+def release_sweep(sweep_id, token):
+    """
+    Releases the sweep lease (also when the sweep failed) and starts coalesced sweep if requested.
+    """
+    lease = get_sweep_lease()
+    if not lease.release(token):
+        current_app.logger.warning(f'Sweep {sweep_id} lease expired before sweep completion')
+    if lease.pop_pending():
+        watchdog_task.delay()
+
+
+def checkpoint_live_status(db):
+    """
+    Persists timestamps from the live status store to db and clears the store (watchdog is stopped).
+    """
+    if not current_app.config.get('WATCHDOG_LIVE_STATUS'):
+        return
+    try:
+        live_store = LiveStatusStore(redis_store.client, key=f'watchdog:live:{db.name}')
+        entries = live_store.get_all()
+        if not entries:
+            return
+        operations = []
+        for service_id, entry in entries.items():
+            update = {
+                f'timestamps.{field}': entry[field] for field in ('last_tested', 'last_responded') if entry[field]
+            }
+            if update:
+                operations.append(UpdateOne({'_id': ObjectId(service_id)}, {'$set': update}))
+        if operations:
+            db.service.bulk_write(operations, ordered=False)
+        live_store.clear()
+        current_app.logger.info(f'Live status of {len(entries)} services persisted')
+    except RedisError as error:
+        current_app.logger.error(f'Error: {error} in checkpoint_live_status')
 
 
 @celery.task(name='watchdog_task')
 def watchdog_task():
     """
     Run watchdog (monitoring) service.
+    The sweep is split into '_id' range shards dispatched as a Celery group (chord) across available workers.
     """
-    mongodb_uri, mongodb_db_name = get_mongo_db_name()
-    with MongoClient(host=mongodb_uri, serverSelectionTimeoutMS=10000) as client:
-        # MongoDB connection timeout is set to 10 sec
-        # Use database from MongoDB URI
-        db = client[mongodb_db_name]
-        watchdog = MonitoringService(db)
+    # Only one sweep at a time - the next run is skipped (or coalesced) while the sweep lease is held
+    try:
+        lease = get_sweep_lease()
+        token = lease.acquire()
+        if not token:
+            SweepMetrics(redis_store.client).skipped()
+            if current_app.config.get('WATCHDOG_SWEEP_OVERLAP') == 'coalesce':
+                lease.mark_pending()
+            current_app.logger.warning('Previous sweep is still running - watchdog run skipped')
+            return
+    except RedisError as error:
+        current_app.logger.error(f'Error: {error} in watchdog_task')
+        return
+    # Use database from MongoDB URI (pooled client shared by worker process)
+    db = get_mongo_db()
+    sweep_id = uuid4().hex
+    started = datetime.utcnow()
+    try:
+        # Only services due for check are split into shards
+        if current_app.config.get('WATCHDOG_SCHEDULE') == 'interval':
+            ahead = current_app.config.get('WATCHDOG_CHECK_INTERVAL')
+        else:
+            ahead = current_app.config.get('WATCHDOG_NEXT_CHECK_SLACK')
+        shard_ranges = get_shard_ranges(db.service, current_app.config.get('WATCHDOG_SHARDS'), due_query(ahead))
+    except errors.ServerSelectionTimeoutError:
+        current_app.logger.error('MongoDB server is not reachable')
+        lease.release(token)
+        return
+    if len(shard_ranges) <= 1:
+        # Run sweep in the current worker
         try:
-            watchdog.start()
-        except errors.ServerSelectionTimeoutError:
-            current_app.logger.error('MongoDB server is not reachable')
+            shard = watchdog_shard_task(shard=0)
+        except Exception:
+            release_sweep(sweep_id, token)
+            raise
+        complete_sweep(db, sweep_id, started, [shard], token)
+        return
+    shard_tasks = [
+        watchdog_shard_task.s(shard=number, id_min=id_min, id_max=id_max, last=number == len(shard_ranges) - 1)
+        for number, (id_min, id_max) in enumerate(shard_ranges)
+    ]
+    sweep_complete_task = watchdog_sweep_complete_task.s(sweep_id=sweep_id, started=started.isoformat(), token=token)
+    # The lease is released also if any shard fails (the chord callback is not called)
+    sweep_complete_task.on_error(watchdog_sweep_failed_task.s(sweep_id=sweep_id, token=token))
+    try:
+        chord(shard_tasks)(sweep_complete_task)
+    except Exception:
+        release_sweep(sweep_id, token)
+        raise
+    current_app.logger.info(f'Sweep {sweep_id} dispatched in {len(shard_tasks)} shards')
+
+
+@celery.task(name='watchdog_shard_task')
+def watchdog_shard_task(shard, id_min=None, id_max=None, last=True):
+    """
+    Run watchdog (monitoring) service for services in the '_id' range (all services if range is not set).
+    Returns shard timing info.
+    """
+    db = get_mongo_db()
+    query = shard_query(id_min, id_max, last) if id_min else None
+    watchdog = get_monitoring_service(db, query=query)
+    start = time.monotonic()
+    services_count = 0
+    try:
+        services_count = watchdog.start()
+    except errors.ServerSelectionTimeoutError:
+        current_app.logger.error('MongoDB server is not reachable')
+    except errors.PyMongoError as error:
+        # E.g. 'AutoReconnect' or 'NetworkTimeout' - the shard is completed, services are checked in next sweep
+        current_app.logger.error(f'Error: {error} in watchdog_shard_task')
+    return {'shard': shard, 'services': services_count, 'duration': round(time.monotonic() - start, 3)}
+
+
+@celery.task(name='watchdog_sweep_complete_task')
+def watchdog_sweep_complete_task(shards, sweep_id, started, token):
+    """
+    Record sweep completion with per-shard timing and release the sweep lease.
+    """
+    db = get_mongo_db()
+    sweep = complete_sweep(db, sweep_id, datetime.fromisoformat(started), shards, token)
+    current_app.logger.info(f'Sweep {sweep_id} completed: {sweep["services"]} services in '
+                            f'{sweep["duration"]:.2f} sec ({len(shards)} shards)')
+
+
+@celery.task(name='watchdog_sweep_failed_task')
+def watchdog_sweep_failed_task(request, exc, traceback, sweep_id, token):
+    """
+    Release the sweep lease if any shard of the sweep failed (chord error callback).
+    """
+    current_app.logger.error(f'Sweep {sweep_id} failed: {exc!r}')
+    release_sweep(sweep_id, token)
 
 
 @celery.task(name='service_unknown_status_task')
@@ -49,9 +201,18 @@ def change_status_to_unknown_task():
         return
 
     if not watchdog_job.enabled:
-        mongodb_uri, mongodb_db_name = get_mongo_db_name()
-        with MongoClient(host=mongodb_uri, serverSelectionTimeoutMS=10000) as client:
-            db = client[mongodb_db_name]
-            # Update all documents in 'service' collection
-            db.service.update_many({}, {'$set': {'status': 'unknown'}})
+        db = get_mongo_db()
+        try:
+            checkpoint_live_status(db)
+            # Update all documents in 'service' collection (services are checked in the first sweep after restart)
+            result = db.service.update_many({'status': {'$ne': 'unknown'}},
+                                            {'$set': {'status': 'unknown', 'next_check': None}})
+            if result.modified_count:
+                # ETags of all services are changed
+                ServiceVersions(redis_store.client, key=f'services:version:{db.name}').increment(epoch=True)
             current_app.logger.info(f'Changed services status to "unknown"')
+        except errors.ServerSelectionTimeoutError:
+            current_app.logger.error('MongoDB server is not reachable')
+        except RedisError as error:
+            current_app.logger.error(f'Error: {error} in service_status_task')
+
@@ -0,0 +1,241 @@
+import asyncio
+import errno
+import socket
+import struct
+from itertools import cycle
+
+
+# Linux socket options used to receive ICMP errors on unconnected UDP sockets
+IP_RECVERR = getattr(socket, 'IP_RECVERR', 11)
+MSG_ERRQUEUE = getattr(socket, 'MSG_ERRQUEUE', 0x2000)
+SO_EE_ORIGIN_ICMP = 2
+ICMP_DEST_UNREACH = 3
+ICMP_PORT_UNREACH = 3
+# Errors of 'sendto' reporting a pending ICMP error (of previously probed target) with IP_RECVERR
+ICMP_ERRNOS = {
+    errno.ECONNREFUSED, errno.EHOSTUNREACH, errno.ENETUNREACH, errno.EHOSTDOWN, errno.ENOPROTOOPT,
+    getattr(errno, 'ENONET', errno.EHOSTUNREACH)
+}
+# Delay (in sec) before sending again when the device queue is full (ENOBUFS)
+SEND_RETRY_DELAY = 0.01
+
+
+def dns_payload() -> bytes:
+    """
+    Returns DNS query (root NS record, recursion desired).
+    """
+    header = struct.pack('>HHHHHH', 0x4d41, 0x0100, 1, 0, 0, 0)
+    question = b'\x00' + struct.pack('>HH', 2, 1)
+    return header + question
+
+
+def ntp_payload() -> bytes:
+    """
+    Returns NTP client request (LI=0, VN=3, Mode=3).
+    """
+    return b'\x1b' + 47 * b'\x00'
+
+
+def snmp_payload() -> bytes:
+    """
+    Returns SNMPv1 GetRequest for 'sysDescr.0' with 'public' community.
+    """
+    return bytes.fromhex('302902010004067075626c6963a01c0204'
+                         '4d4f4e49020100020100300e300c06082b060102010101000500')
+
+
+UDP_PAYLOADS = {
+    53: dns_payload(),
+    123: ntp_payload(),
+    161: snmp_payload(),
+}
+
+
+def udp_payload(port: int) -> bytes:
+    """
+    Returns protocol-appropriate payload for the specified port (empty datagram by default).
+    """
+    return UDP_PAYLOADS.get(port, b'')
+
+
+class UdpProber:
+    """
+    Class specifying the UDP prober. Targets are multiplexed over a few non-blocking sockets on the running
+    event loop. The port state is determined as follows:
+    - 'open' - target responded with a datagram;
+    - 'closed' - ICMP port unreachable received (read from socket error queue with IP_RECVERR);
+    - 'filtered' - other ICMP destination unreachable received;
+    - 'open|filtered' - no response within timeout.
+    """
+    def __init__(self, timeout=2, sockets_count=4):
+        self.timeout = timeout
+        self.sockets_count = sockets_count
+        self._sockets = []
+        self._sockets_cycle = None
+        # Pending probes - (ip, port) -> future with port state
+        self._pending = {}
+        # Sockets with full send buffer - socket -> future done when the socket is writable
+        self._writers = {}
+
+    async def __aenter__(self):
+        self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def open(self):
+        """
+        Creates sockets and registers them in the running event loop.
+        """
+        loop = asyncio.get_running_loop()
+        for _ in range(self.sockets_count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            try:
+                sock.setsockopt(socket.IPPROTO_IP, IP_RECVERR, 1)
+            except OSError:
+                # ICMP errors are not available (non-Linux) - closed ports are reported as 'open|filtered'
+                pass
+            loop.add_reader(sock.fileno(), self._on_readable, sock)
+            self._sockets.append(sock)
+        self._sockets_cycle = cycle(self._sockets)
+
+    def close(self):
+        """
+        Unregisters and closes sockets.
+        """
+        loop = asyncio.get_running_loop()
+        for sock in self._sockets:
+            loop.remove_reader(sock.fileno())
+            if sock in self._writers:
+                loop.remove_writer(sock.fileno())
+            sock.close()
+        self._sockets = []
+        for future in self._writers.values():
+            future.cancel()
+        self._writers = {}
+        for future in self._pending.values():
+            if not future.done():
+                future.cancel()
+        self._pending = {}
+
+    async def probe(self, ip_address: str, port: str) -> str:
+        """
+        Sends payload to target and waits for the response or ICMP error.
+        """
+        target = (ip_address, int(port))
+        future = self._pending.get(target)
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._pending[target] = future
+            await self._send(next(self._sockets_cycle), target)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            return 'open|filtered'
+        finally:
+            if self._pending.get(target) is future:
+                del self._pending[target]
+
+    async def _send(self, sock, target: tuple, attempts=3):
+        """
+        Sends payload to target. With IP_RECVERR the pending ICMP error of a previously probed target is reported
+        by the next 'sendto' on the socket, so the error queue is read (errors are set to their targets) and the
+        payload is sent again. Only the error of the last attempt (with empty error queue) belongs to the target.
+        If the send buffer is full, the payload is sent again when the socket is writable (within timeout).
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        while attempts:
+            try:
+                sock.sendto(udp_payload(target[1]), target)
+                return
+            except BlockingIOError:
+                if not await self._wait_writable(sock, deadline - loop.time()):
+                    break
+            except OSError as error:
+                if error.errno in ICMP_ERRNOS:
+                    self._read_errors(sock)
+                    attempts -= 1
+                elif error.errno == errno.ENOBUFS and loop.time() < deadline:
+                    await asyncio.sleep(SEND_RETRY_DELAY)
+                else:
+                    break
+        self._set_state(target, 'filtered')
+
+    async def _wait_writable(self, sock, timeout: float) -> bool:
+        """
+        Waits until the socket is writable (one writer callback is shared by all probes of the socket).
+        Returns False if the socket is not writable within timeout.
+        """
+        if timeout <= 0:
+            return False
+        future = self._writers.get(sock)
+        if future is None:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._writers[sock] = future
+
+            def on_writable():
+                loop.remove_writer(sock.fileno())
+                del self._writers[sock]
+                future.set_result(True)
+
+            loop.add_writer(sock.fileno(), on_writable)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except asyncio.TimeoutError:
+            return False
+
+    def _set_state(self, target: tuple, state: str):
+        future = self._pending.get(target)
+        if future is not None and not future.done():
+            future.set_result(state)
+
+    def _on_readable(self, sock):
+        """
+        Reads ICMP errors from the socket error queue and responses from targets.
+        """
+        self._read_errors(sock)
+        while True:
+            try:
+                _, address = sock.recvfrom(4096)
+            except OSError:
+                # No more datagrams (or pending socket error already read from the error queue)
+                break
+            self._set_state(address[:2], 'open')
+
+    def _read_errors(self, sock):
+        while True:
+            try:
+                _, ancdata, _, address = sock.recvmsg(512, 512, MSG_ERRQUEUE)
+            except OSError:
+                return
+            for cmsg_level, cmsg_type, cmsg_data in ancdata:
+                if cmsg_level != socket.IPPROTO_IP or cmsg_type != IP_RECVERR:
+                    continue
+                # struct sock_extended_err - ee_errno, ee_origin, ee_type, ee_code
+                _, ee_origin, ee_type, ee_code = struct.unpack_from('=IBBB', cmsg_data)
+                if ee_origin == SO_EE_ORIGIN_ICMP and ee_type == ICMP_DEST_UNREACH:
+                    state = 'closed' if ee_code == ICMP_PORT_UNREACH else 'filtered'
+                    self._set_state(address[:2], state)
+
+
+def udp_state_up(state: str, no_response_up=True) -> bool:
+    """
+    Returns True if the UDP port state means the service is up. Port without any response ('open|filtered')
+    is up only if 'no_response_up' is set (as 'open|filtered' port reported by nmap, services often ignore
+    an empty datagram).
+    """
+    return state == 'open' or (no_response_up and state == 'open|filtered')
+
+
+def udp_port_state(ip_address: str, port: str, timeout=2) -> str:
+    """
+    Probes single UDP target (blocking call, runs its own event loop).
+    """
+    async def probe():
+        async with UdpProber(timeout=timeout, sockets_count=1) as prober:
+            return await prober.probe(ip_address, port)
+    return asyncio.run(probe())
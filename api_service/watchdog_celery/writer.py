@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+from threading import Lock
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
+from flask import current_app
+from redis.exceptions import RedisError
+
+
+class StatusWriter:
+    """
+    Class specifying the writer collecting probe results of a sweep.
+    Results are flushed to MongoDB as unordered 'bulk_write' batches with one combined '$set' per service.
+    With the live status store results are written to Redis and only status transitions, updates required by
+    the schedule and periodic checkpoints are written to MongoDB.
+    Versions (ETags) of the written services are changed after each batch.
+    """
+    def __init__(self, collection, batch_size=500, write_concern=None, live_store=None, checkpoint_interval=300,
+                 versions=None):
+        if write_concern:
+            collection = collection.with_options(write_concern=WriteConcern(**write_concern))
+        self.collection = collection
+        self.batch_size = batch_size
+        self.live_store = live_store
+        self.checkpoint_interval = timedelta(seconds=checkpoint_interval)
+        self.versions = versions
+        self._results = []
+        self._lock = Lock()
+
+    def add(self, service_id, update: dict, status: str, persist=True):
+        """
+        Adds '$set' update of the service document. Flushes the batch if it is full.
+        Updates not marked to 'persist' are written to MongoDB only at checkpoint (if the live store is used).
+        """
+        with self._lock:
+            self._results.append((service_id, update, status, persist))
+            if len(self._results) < self.batch_size:
+                return
+            results, self._results = self._results, []
+        self.write(results)
+
+    def flush(self):
+        """
+        Writes all collected updates.
+        """
+        with self._lock:
+            results, self._results = self._results, []
+        if results:
+            self.write(results)
+
+    def write(self, results: list):
+        operations = None
+        if self.live_store:
+            try:
+                operations = self.write_live(results)
+            except RedisError as error:
+                # Fall back to writing all updates to MongoDB
+                current_app.logger.error(f'Error: {error} in live status write')
+        if operations is None:
+            operations = [UpdateOne({'_id': service_id}, {'$set': update}) for service_id, update, _, _ in results]
+        if operations:
+            try:
+                self.collection.bulk_write(operations, ordered=False)
+            except BulkWriteError as error:
+                current_app.logger.error(f'Bulk write of service status failed: {error.details["writeErrors"]}')
+        if self.versions:
+            try:
+                self.versions.increment([service_id for service_id, _, _, _ in results])
+            except RedisError as error:
+                current_app.logger.error(f'Error: {error} in service versions update')
+
+    def write_live(self, results: list) -> list:
+        """
+        Writes results to the live status store. Returns MongoDB operations for results to be persisted.
+        """
+        now = datetime.utcnow()
+        previous_entries = self.live_store.get_many([service_id for service_id, _, _, _ in results])
+        entries = {}
+        operations = []
+        for service_id, update, status, persist in results:
+            previous = previous_entries.get(str(service_id), {})
+            entry = {
+                'status': status,
+                'last_tested': update.get('timestamps.last_tested', previous.get('last_tested')),
+                'last_responded': update.get('timestamps.last_responded', previous.get('last_responded')),
+                'checkpoint': previous.get('checkpoint')
+            }
+            if persist or not entry['checkpoint'] or now - entry['checkpoint'] >= self.checkpoint_interval:
+                # Timestamps not written since the last checkpoint are persisted too
+                update = dict(update)
+                for field in ('last_tested', 'last_responded'):
+                    if entry[field]:
+                        update[f'timestamps.{field}'] = entry[field]
+                operations.append(UpdateOne({'_id': service_id}, {'$set': update}))
+                entry['checkpoint'] = now
+            entries[str(service_id)] = entry
+        self.live_store.set_many(entries)
+        return operations
@@ -20,6 +20,20 @@ class Config:
     # Default number of documents on page (api results pagination)
     DEFAULT_PAGINATION_LIMIT = 6
     MAX_PAGINATION_LIMIT = 30
+    # Total number of services - 'exact' (counted in db), 'cached' (counter cached in Redis, recomputed after TTL)
+    # or 'estimated' (estimated from collection metadata)
+    SERVICES_COUNT_MODE = os.environ.get('SERVICES_COUNT_MODE', 'cached')
+    SERVICES_COUNT_TTL = 300
+    # Services pages are cached in Redis for TTL (in sec) and invalidated on any change of services (0 disables cache)
+    SERVICES_CACHE_TTL = int(os.environ.get('SERVICES_CACHE_TTL', 30))
+    # Bulk import of services - max number of services in request and number of services validated/inserted at once
+    SERVICES_BULK_MAX_ITEMS = 10000
+    SERVICES_BULK_CHUNK_SIZE = 1000
+    # Services export - number of services read from db cursor and streamed at once
+    SERVICES_EXPORT_BATCH_SIZE = 1000
+    # Responses larger than min size (in bytes) are compressed with gzip if accepted by the client (None disables)
+    RESPONSE_COMPRESSION_MIN_SIZE = 1024
+    RESPONSE_COMPRESSION_LEVEL = 6
     # Flasgger Config
     SWAGGER = {
         'title': 'Monitoring API',
@@ -33,9 +47,68 @@ class Config:
         # 'specs_route': '/apidocs/'
 
     }
+    # Redis Config (Redis used by the Celery broker by default)
+    REDIS_URL = os.environ.get('REDIS_URL', os.environ.get('CELERY_BROKER_URL', 'redis://localhost:6379/0'))
+    REDIS_OPTIONS = {
+        'socket_connect_timeout': 1,
+        'socket_timeout': 1,
+    }
     # Celery Config
     WATCHDOG_CHECK_INTERVAL = 30
     BACKGROUND_CHECK_INTERVAL = 20
+    # Watchdog mode - 'asyncio' (all services probed on one event loop) or 'thread' (thread per service)
+    WATCHDOG_MODE = os.environ.get('WATCHDOG_MODE', 'asyncio')
+    # Watchdog schedule - 'sweep' (all services checked every WATCHDOG_CHECK_INTERVAL) or 'interval'
+    # (each service checked according to its own 'check_interval', always with the asyncio engine)
+    WATCHDOG_SCHEDULE = os.environ.get('WATCHDOG_SCHEDULE', 'sweep')
+    # Number of '_id' range shards the sweep is split into (shards are dispatched across Celery workers)
+    WATCHDOG_SHARDS = int(os.environ.get('WATCHDOG_SHARDS', 4))
+    # Sweep lease (Redis lock) - new watchdog run is skipped ('skip') or coalesced into one follow-up sweep
+    # ('coalesce') while the previous sweep is running. The lease expires after TTL (in sec) - lease of a crashed
+    # sweep blocks at most a few runs.
+    WATCHDOG_SWEEP_OVERLAP = os.environ.get('WATCHDOG_SWEEP_OVERLAP', 'skip')
+    WATCHDOG_SWEEP_LEASE_TTL = 3 * WATCHDOG_CHECK_INTERVAL
+    # Sweep records (completion and per-shard timing) are removed after retention (in sec) by the TTL index
+    # created with 'flask indexes create'
+    WATCHDOG_SWEEP_RETENTION = 7 * 24 * 3600
+    # Services with 'next_check' within slack (in sec) are checked in current sweep
+    WATCHDOG_NEXT_CHECK_SLACK = 5
+    # Probe timeout (in sec) used by the asyncio probe engine
+    WATCHDOG_PROBE_TIMEOUT = 2
+    # Number of sockets the UDP probes are multiplexed over
+    WATCHDOG_UDP_SOCKETS = 4
+    # UDP service is 'up' if it responds with a datagram. Port without any response (no ICMP error within timeout)
+    # is 'open|filtered' - treated as 'up' by default (the same as nmap 'open|filtered' state), set False to
+    # require a response (generic UDP services often ignore an empty datagram).
+    WATCHDOG_UDP_NO_RESPONSE_UP = True
+    # Max number of in-flight probes (globally and per destination host), in both 'asyncio' and 'thread' mode.
+    # The global limit is capped by the process RLIMIT_NOFILE minus reserved file descriptors (divided by the number
+    # of descriptors used by one probe in the 'thread' mode).
+    WATCHDOG_MAX_IN_FLIGHT = 512
+    WATCHDOG_MAX_PER_HOST = 8
+    WATCHDOG_RESERVED_FDS = 64
+    # DNS cache - record TTLs are clamped to min/max, unresolvable hostnames are cached for negative TTL.
+    # Default TTL is used for addresses resolved by the system resolver (e.g. from /etc/hosts).
+    WATCHDOG_DNS_MIN_TTL = 5
+    WATCHDOG_DNS_MAX_TTL = 3600
+    WATCHDOG_DNS_NEGATIVE_TTL = 60
+    WATCHDOG_DNS_DEFAULT_TTL = 60
+    # Probe results are written back to MongoDB with unordered 'bulk_write' batches
+    WATCHDOG_BULK_BATCH_SIZE = 500
+    WATCHDOG_BULK_WRITE_CONCERN = {'w': 1}
+    # Live status (status and last tested/responded times) is kept in Redis. Only status transitions are written
+    # to MongoDB immediately, the timestamps are persisted at checkpoint interval (in sec).
+    WATCHDOG_LIVE_STATUS = True
+    WATCHDOG_CHECKPOINT_INTERVAL = 300
+    # MongoClient (shared by all tasks of the Celery worker process) - pool size and timeouts
+    WATCHDOG_MONGO_CLIENT = {
+        'maxPoolSize': 50,
+        'minPoolSize': 0,
+        'maxIdleTimeMS': 60000,
+        'serverSelectionTimeoutMS': 10000,
+        'connectTimeoutMS': 5000,
+        'socketTimeoutMS': 30000,
+    }
     CELERY = {
         'broker_url': os.environ.get("CELERY_BROKER_URL"),
         'result_backend': os.environ.get("CELERY_RESULT_BACKEND_URL"),
@@ -77,9 +150,13 @@ class TestConfig(Config):
     """
     DEBUG = True
     TESTING = True
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'testing-secret-key')
     MONGODB_SETTINGS = {
         'host': os.environ.get('MONGODB_URI_TEST', 'mongodb://localhost:27017/testdb'),
     }
+    # Test fixtures add services directly to db
+    SERVICES_COUNT_MODE = 'exact'
+    SERVICES_CACHE_TTL = 0
 
 
 class DevConfig(Config):
@@ -87,6 +164,7 @@ class DevConfig(Config):
     Set Flask configuration vars for testing.
     """
     DEBUG = True
+    SECRET_KEY = os.environ.get('SECRET_KEY', 'development-secret-key')
     MONGODB_SETTINGS = {
         'host': os.environ.get('MONGODB_URI_DEV', 'mongodb://localhost:27017/devdb'),
     }
@@ -1,9 +1,12 @@
 import os
 
+from flask import Flask
 from pytest import fixture
 from pymongo.uri_parser import parse_uri
 from mongoengine import connect, disconnect
+from redis import Redis
 
+from config import app_config
 from api_service import create_app
 from api_service.extensions import db
 from api_service.models import Service
@@ -125,3 +128,13 @@ def init_database():
     db_connection.drop_database(db_name)
 
 
+@fixture(scope='module')
+def redis_client():
+    return Redis.from_url(app_config['testing'].REDIS_URL)
+
+
+@fixture
+def app_context():
+    # Plain application context (the app with registered resources can be created only once in tests)
+    with Flask(__name__).app_context():
+        yield
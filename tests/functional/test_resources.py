@@ -1,7 +1,14 @@
+import csv
+import gzip
+import io
 import json
+import msgpack
 from bson import objectid
 from flask import current_app
 
+from api_service.models import Service
+from api_service.services.utils import decode_cursor, get_service_counters
+
 
 def test_get_services_endpoint_empty(test_client):
     """
@@ -121,6 +128,70 @@ def test_create_and_delete_service(test_client, example_service_data):
     assert response.status_code == 200
 
 
+def test_create_service_with_check_interval(test_client, example_service_data):
+    """
+    GIVEN Flask application configured for testing
+    WHEN the '/services' endpoint is posted (POST) with 'check_interval'
+    THEN check that a '400' code is returned for invalid interval and the interval is stored otherwise
+    """
+    post_data = example_service_data
+    post_data['name'] = 'service-check-interval-001'
+    headers = {
+        "Content-Type": "application/json",
+    }
+    for check_interval in [0, 4, 86401, 'test']:
+        post_data['check_interval'] = check_interval
+        response = test_client.post('/services', headers=headers, data=json.dumps(post_data))
+        assert response.status_code == 400
+    post_data['check_interval'] = 5
+    response = test_client.post('/services', headers=headers, data=json.dumps(post_data))
+    assert response.status_code == 201
+    service_id = response.get_json()['id']
+    response = test_client.get(f'/services/{service_id}')
+    assert response.get_json()['service']['check_interval'] == 5
+    # Delete added service
+    response = test_client.delete(f'/services/{service_id}')
+    assert response.status_code == 200
+
+
+def test_create_services_bulk(test_client, example_service_data):
+    """
+    GIVEN Flask application configured for testing
+    WHEN the '/services/bulk' endpoint is posted (POST) with JSON array and NDJSON
+    THEN check that valid services are created and per-service results are returned
+    """
+    services = []
+    for name in ['service-bulk-001', 'service-bulk-002', 'service-bulk-001']:
+        service = dict(example_service_data)
+        service['name'] = name
+        services.append(service)
+    services.append({'name': 'service-bulk-003'})
+    response = test_client.post('/services/bulk', headers={"Content-Type": "application/json"},
+                                data=json.dumps(services))
+    json_data = response.get_json()
+    assert response.status_code == 207
+    assert json_data['created'] == 2
+    assert json_data['failed'] == 2
+    assert [result['status'] for result in json_data['services']] == [201, 201, 400, 400]
+    assert json_data['services'][3]['message']['host'] == 'Host field is required.'
+    service_ids = [result['id'] for result in json_data['services'] if result['status'] == 201]
+    # Services already in db and invalid line are not created
+    lines = [json.dumps(services[1]), 'not json', json.dumps(dict(services[1], name='service-bulk-004'))]
+    response = test_client.post('/services/bulk', headers={"Content-Type": "application/x-ndjson"},
+                                data='\n'.join(lines))
+    json_data = response.get_json()
+    assert response.status_code == 207
+    assert [result['status'] for result in json_data['services']] == [400, 400, 201]
+    service_ids.append(json_data['services'][2]['id'])
+    response = test_client.post('/services/bulk', headers={"Content-Type": "application/json"},
+                                data=json.dumps({'name': 'service-bulk-005'}))
+    assert response.status_code == 400
+    # Delete added services
+    for service_id in service_ids:
+        response = test_client.delete(f'/services/{service_id}')
+        assert response.status_code == 200
+
+
 def test_delete_service_not_exist(test_client):
     """
     GIVEN Flask application configured for testing and random generated service id
@@ -246,6 +317,8 @@ def test_patch_service_bad_request(test_client):
     path_data = {'name': 'test-service-ssh'}
     response = test_client.patch(f'/services/{service_id}', headers=headers, data=json.dumps(path_data))
     assert response.status_code == 400
+    assert response.get_json()['message']['name'] == \
+           'Service test-service-ssh already exists, please use a different name.'
     # Wrong host type
     path_data = {
         'host': {
@@ -457,14 +530,14 @@ def test_cursor_after_with_custom_pagination_limit(test_client):
     """
     GIVEN Flask application configured for testing and services in db
     WHEN Custom pagination limit is used (only 'limit' query param in URL)
-    THEN Response returns first page. Id of last service on page should be equal to 'after' cursor
+    THEN Response returns first page. Id of last service on page should be equal to 'after' cursor id
     """
     response = test_client.get('/services?limit=2')
     json_data = response.get_json()
     last_service_id = json_data['data']['services'][-1]['id']
     cursor_after = json_data['paging']['cursors']['after']
-    # id of last service on page should be equal to 'after' cursor
-    assert last_service_id == cursor_after
+    # id of last service on page should be equal to 'after' cursor id
+    assert last_service_id == decode_cursor(cursor_after)['id']
 
 
 def test_cursor_after_next_page(test_client):
@@ -485,7 +558,7 @@ def test_cursor_after_next_page(test_client):
     first_service_id = json_data['data']['services'][0]['id']
     second_service_id = json_data['data']['services'][1]['id']
     # Use bson to test proper order
-    cursor_after_bson_id = objectid.ObjectId(cursor_after)
+    cursor_after_bson_id = objectid.ObjectId(decode_cursor(cursor_after)['id'])
     first_service_bson_id = objectid.ObjectId(first_service_id)
     second_service_bson_id = objectid.ObjectId(second_service_id)
     # Check that first id gt cursor
@@ -495,8 +568,8 @@ def test_cursor_after_next_page(test_client):
     # Check cursors on second page
     cursor_before_next_page = json_data['paging']['cursors']['before']
     cursor_after_next_page = json_data['paging']['cursors']['after']
-    assert cursor_before_next_page == first_service_id
-    assert cursor_after_next_page == second_service_id
+    assert decode_cursor(cursor_before_next_page)['id'] == first_service_id
+    assert decode_cursor(cursor_after_next_page)['id'] == second_service_id
     # Check that URLs are not empty.
     url_prev = json_data['paging']['links']['previous']
     url_next = json_data['paging']['links']['next']
@@ -521,7 +594,7 @@ def test_cursor_before_prev_page(test_client):
     first_service_id = json_data['data']['services'][0]['id']
     # Get 'before' cursor on next page
     cursor_before_next_page = json_data['paging']['cursors']['before']
-    assert cursor_before_next_page == first_service_id
+    assert decode_cursor(cursor_before_next_page)['id'] == first_service_id
     # Get previous page (first page)
     response = test_client.get(f'/services?limit=2&before={cursor_before_next_page}')
     assert response.status_code == 200
@@ -529,7 +602,7 @@ def test_cursor_before_prev_page(test_client):
     first_service_id = json_data['data']['services'][0]['id']
     second_service_id = json_data['data']['services'][1]['id']
     # Use bson to test proper order
-    cursor_before_bson_id = objectid.ObjectId(cursor_before_next_page)
+    cursor_before_bson_id = objectid.ObjectId(decode_cursor(cursor_before_next_page)['id'])
     first_service_bson_id = objectid.ObjectId(first_service_id)
     second_service_bson_id = objectid.ObjectId(second_service_id)
     # Check that first id lt second id
@@ -538,6 +611,266 @@ def test_cursor_before_prev_page(test_client):
     assert first_service_bson_id < cursor_before_bson_id
 
 
+def test_cursor_before_prev_page_sorted_descending(test_client):
+    """
+    GIVEN Flask application configured for testing and services in db
+    WHEN Descending sort is used with 'after' and then 'before' query param
+    THEN Response returns the same first page with proper cursors
+    """
+    response = test_client.get('/services?limit=2&sort=-name')
+    json_data = response.get_json()
+    first_page_names = [service['name'] for service in json_data['data']['services']]
+    cursor_after = json_data['paging']['cursors']['after']
+    # Get next page (second page)
+    response = test_client.get(f'/services?limit=2&sort=-name&after={cursor_after}')
+    json_data = response.get_json()
+    cursor_before_next_page = json_data['paging']['cursors']['before']
+    # Get previous page (first page)
+    response = test_client.get(f'/services?limit=2&sort=-name&before={cursor_before_next_page}')
+    assert response.status_code == 200
+    json_data = response.get_json()
+    assert [service['name'] for service in json_data['data']['services']] == first_page_names
+    assert first_page_names == sorted(first_page_names, reverse=True)
+    # First page - no 'before' cursor
+    assert json_data['paging']['cursors']['before'] == ''
+    assert json_data['paging']['cursors']['after'] != ''
+
+
+def test_cursor_not_valid(test_client):
+    """
+    GIVEN Flask application configured for testing and services in db
+    WHEN Forged cursor or cursor of different sort order is used
+    THEN check that a '400' code is returned
+    """
+    response = test_client.get('/services?limit=2&sort=name')
+    cursor_after = response.get_json()['paging']['cursors']['after']
+    for query_params in [f'after={objectid.ObjectId()}', f'after={cursor_after}x', f'before={cursor_after}&sort=-id']:
+        response = test_client.get(f'/services?limit=2&{query_params}')
+        assert response.status_code == 400
+
+
+def test_get_services_filtered(test_client):
+    """
+    GIVEN Flask application configured for testing and services in db
+    WHEN the '/services' endpoint is requested (GET) with filter query params
+    THEN check that only matching services are returned on all pages (next page links keep filters)
+    """
+    response = test_client.get('/services?limit=1&proto=udp&host.value=192.168.1.')
+    json_data = response.get_json()
+    assert response.status_code == 200
+    services_total = json_data['data']['services_total']
+    assert services_total >= 1
+    services = json_data['data']['services']
+    while json_data['paging']['links']['next']:
+        response = test_client.get(json_data['paging']['links']['next'])
+        json_data = response.get_json()
+        assert json_data['data']['services_total'] == services_total
+        services.extend(json_data['data']['services'])
+    assert len(services) == services_total
+    for service in services:
+        assert service['proto'] == 'udp'
+        assert service['host']['value'].startswith('192.168.1.')
+    # Prefix is not matched as regex
+    response = test_client.get('/services?host.value=.*')
+    assert response.get_json()['data']['services_total'] == 0
+    for query_params in ['status=test', 'proto=smtp', 'host.type=test', 'host.value=']:
+        response = test_client.get(f'/services?{query_params}')
+        assert response.status_code == 400
+
+
+def test_get_services_sparse_fields(test_client):
+    """
+    GIVEN Flask application configured for testing and services in db
+    WHEN the '/services' and '/services/{service_id}' endpoints are requested (GET) with 'fields' query param
+    THEN check that only requested fields are returned
+    """
+    response = test_client.get('/services?limit=2&sort=name&fields=status,id')
+    json_data = response.get_json()
+    assert response.status_code == 200
+    for service in json_data['data']['services']:
+        assert list(service) == ['id', 'status']
+    # Next page keeps the fields
+    response = test_client.get(json_data['paging']['links']['next'])
+    for service in response.get_json()['data']['services']:
+        assert list(service) == ['id', 'status']
+    service_id = json_data['data']['services'][0]['id']
+    response = test_client.get(f'/services/{service_id}?fields=name,timestamps')
+    assert response.status_code == 200
+    assert list(response.get_json()['service']) == ['name', 'timestamps']
+    for query_params in ['fields=', 'fields=id,test', 'fields=_id']:
+        response = test_client.get(f'/services?{query_params}')
+        assert response.status_code == 400
+        response = test_client.get(f'/services/{service_id}?{query_params}')
+        assert response.status_code == 400
+
+
+def test_export_services(test_client):
+    """
+    GIVEN Flask application configured for testing and services in db
+    WHEN the '/services/export' endpoint is requested (GET)
+    THEN check that all services are exported as NDJSON, CSV or gzip compressed NDJSON
+    """
+    services_total = test_client.get('/services').get_json()['data']['services_total']
+    response = test_client.get('/services/export')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    services = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(services) == services_total
+    assert len({service['id'] for service in services}) == services_total
+    response = test_client.get('/services/export?format=csv&fields=id,host&proto=tcp')
+    assert response.mimetype == 'text/csv'
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    assert rows[0] == ['id', 'host.type', 'host.value']
+    assert len(rows) - 1 == test_client.get('/services?proto=tcp').get_json()['data']['services_total']
+    response = test_client.get('/services/export', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert len(gzip.decompress(response.get_data()).splitlines()) == services_total
+    response = test_client.get('/services/export?format=xml')
+    assert response.status_code == 400
+
+
+def test_get_services_representations(test_client):
+    """
+    GIVEN Flask application configured for testing and services in db
+    WHEN the '/services' endpoint is requested (GET) with 'Accept' and 'Accept-Encoding' headers
+    THEN check that services are returned as MessagePack and large responses are compressed with gzip
+    """
+    response = test_client.get('/services')
+    json_data = response.get_json()
+    json_etag = response.headers['ETag']
+    response = test_client.get('/services', headers={'Accept': 'application/msgpack'})
+    assert response.status_code == 200
+    assert response.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(response.get_data()) == json_data
+    # Each representation has its own ETag
+    assert response.headers['ETag'] != json_etag
+    msgpack_etag = response.headers['ETag']
+    # ETag of the representation selected for the tied qualities
+    response = test_client.get('/services', headers={'Accept': 'application/msgpack, application/json'})
+    assert response.headers['ETag'] == (json_etag if response.mimetype == 'application/json' else msgpack_etag)
+    current_app.config['RESPONSE_COMPRESSION_MIN_SIZE'] = 10
+    response = test_client.get('/services', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(response.get_data())) == json_data
+    gzip_etag = response.headers['ETag']
+    assert gzip_etag == f'{json_etag[:-1]}-gzip"'
+    response = test_client.get('/services', headers={'Accept-Encoding': 'gzip', 'If-None-Match': gzip_etag})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == gzip_etag
+    # Small response is not compressed
+    current_app.config['RESPONSE_COMPRESSION_MIN_SIZE'] = 1024
+    response = test_client.get(f'/services/{objectid.ObjectId()}', headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 404
+    assert 'Content-Encoding' not in response.headers
+    assert response.get_json()['status'] == 404
+
+
+def test_get_services_not_modified(test_client, example_service_data):
+    """
+    GIVEN Flask application configured for testing and services in db
+    WHEN the '/services' endpoint is requested (GET) with 'If-None-Match' header
+    THEN check that '304' code is returned if services have not changed and '200' otherwise
+    """
+    response = test_client.get('/services?limit=2')
+    etag = response.headers.get('ETag')
+    assert etag
+    response = test_client.get('/services?limit=2', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    # ETag depends on query params
+    response = test_client.get('/services?limit=3', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    # Service added - services changed
+    post_data = example_service_data
+    post_data['name'] = 'service-etag-001'
+    headers = {
+        "Content-Type": "application/json",
+    }
+    response = test_client.post('/services', headers=headers, data=json.dumps(post_data))
+    service_id = response.get_json()['id']
+    response = test_client.get('/services?limit=2', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    # Single service ETag
+    response = test_client.get(f'/services/{service_id}')
+    service_etag = response.headers.get('ETag')
+    response = test_client.get(f'/services/{service_id}', headers={'If-None-Match': service_etag})
+    assert response.status_code == 304
+    response = test_client.patch(f'/services/{service_id}', headers=headers, data=json.dumps({'port': '54'}))
+    assert response.status_code == 200
+    response = test_client.get(f'/services/{service_id}', headers={'If-None-Match': service_etag})
+    assert response.status_code == 200
+    # Delete added service
+    response = test_client.delete(f'/services/{service_id}')
+    assert response.status_code == 200
+
+
+def test_get_services_cached(test_client, example_service_data):
+    """
+    GIVEN Flask application configured for testing with services pages cache enabled
+    WHEN the '/services' endpoint is requested (GET) several times
+    THEN check that the page is returned from cache until services are changed
+    """
+    current_app.config['SERVICES_CACHE_TTL'] = 30
+    response = test_client.get('/services?limit=2')
+    assert response.headers.get('X-Cache') == 'MISS'
+    json_data = response.get_json()
+    response = test_client.get('/services?limit=2')
+    assert response.headers.get('X-Cache') == 'HIT'
+    assert response.get_json() == json_data
+    # Cache bypassed
+    response = test_client.get('/services?limit=2', headers={'Cache-Control': 'no-cache'})
+    assert response.headers.get('X-Cache') == 'BYPASS'
+    # Service added - cache invalidated
+    post_data = example_service_data
+    post_data['name'] = 'service-cache-001'
+    headers = {
+        "Content-Type": "application/json",
+    }
+    response = test_client.post('/services', headers=headers, data=json.dumps(post_data))
+    service_id = response.get_json()['id']
+    response = test_client.get('/services?limit=2')
+    assert response.headers.get('X-Cache') == 'MISS'
+    assert response.get_json()['data']['services_total'] == json_data['data']['services_total'] + 1
+    # Delete added service
+    response = test_client.delete(f'/services/{service_id}')
+    assert response.status_code == 200
+    current_app.config['SERVICES_CACHE_TTL'] = 0
+
+
+def test_count_services_cached(test_client, example_service_data):
+    """
+    GIVEN Flask application configured for testing with services total cached in Redis
+    WHEN services are added and deleted
+    THEN check that the cached services total follows the number of services in db
+    """
+    current_app.config['SERVICES_COUNT_MODE'] = 'cached'
+    counters = get_service_counters()
+    counters.redis.delete(counters.key)
+    services_total = Service.objects.count()
+    response = test_client.get('/services')
+    assert response.get_json()['data']['services_total'] == services_total
+    assert int(counters.redis.get(counters.key)) == services_total
+    # Service added - counter incremented
+    post_data = example_service_data
+    post_data['name'] = 'service-count-001'
+    headers = {
+        "Content-Type": "application/json",
+    }
+    response = test_client.post('/services', headers=headers, data=json.dumps(post_data))
+    service_id = response.get_json()['id']
+    response = test_client.get('/services')
+    assert response.get_json()['data']['services_total'] == services_total + 1
+    # Filtered services are counted in db
+    response = test_client.get('/services?proto=udp')
+    assert response.get_json()['data']['services_total'] == Service.objects(proto='udp').count()
+    # Service deleted - counter decremented
+    response = test_client.delete(f'/services/{service_id}')
+    assert response.status_code == 200
+    response = test_client.get('/services')
+    assert response.get_json()['data']['services_total'] == services_total
+    counters.redis.delete(counters.key)
+    current_app.config['SERVICES_COUNT_MODE'] = 'exact'
+
+
 def test_watchdog_not_running(test_client):
     """
     GIVEN Flask application configured for testing and watchdog service is not running
@@ -548,6 +881,7 @@ def test_watchdog_not_running(test_client):
     json_data = response.get_json()
     assert response.status_code == 200
     assert json_data['watchdog_status'] == 'down'
+    assert 'metrics' in json_data
 
 
 def test_get_services_status_watchdog_not_running(test_client):
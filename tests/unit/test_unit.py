@@ -1,4 +1,34 @@
-from api_service.models import Service
+import asyncio
+import errno
+import json
+import socket
+import time
+from datetime import datetime, timedelta
+from threading import Lock, Thread
+
+import pytest
+from bson import ObjectId
+from flask import current_app
+from redis.exceptions import TimeoutError as RedisTimeoutError
+
+from api_service.extensions import redis_store
+from api_service.models import Service, Timestamps
+from api_service.services.counters import ServiceCounters
+from api_service.services.schemas import ServiceSchema
+from api_service.services.serializers import serialize_service
+from api_service.services.utils import get_watchdog_metrics
+from api_service.watchdog_celery.engine import AsyncProbeEngine
+from api_service.watchdog_celery.resolver import DnsCache
+from api_service.watchdog_celery.scheduler import IntervalScheduler, ProbeScheduler, fd_limit
+from api_service.watchdog_celery.sweeps import (
+    due_query, get_shard_ranges, shard_query, ensure_sweep_retention, get_sweep_retention
+)
+from api_service.watchdog_celery.udp import udp_payload, UdpProber, udp_state_up
+from api_service.watchdog_celery.lease import SweepLease, SweepMetrics
+from api_service.watchdog_celery.live_status import LiveStatusStore
+from api_service.watchdog_celery.monitoring import MonitoringService
+from api_service.watchdog_celery.tasks import get_sweep_lease, watchdog_task
+from api_service.watchdog_celery.writer import StatusWriter
 
 
 def test_new_service_model(init_database):
@@ -24,3 +54,601 @@ def test_new_service_model(init_database):
     assert service.proto == 'tcp'
     assert service.port == '23'
     assert not service.status == 'up'
+
+
+def test_udp_payloads():
+    """
+    GIVEN a UDP port of the monitored service
+    WHEN UDP probe payload is requested
+    THEN check that protocol-aware payload is returned (empty datagram for other ports)
+    """
+    dns_payload = udp_payload(53)
+    # One question in DNS header
+    assert dns_payload[4:6] == b'\x00\x01'
+    ntp_payload = udp_payload(123)
+    assert len(ntp_payload) == 48
+    assert ntp_payload[0] == 0x1b
+    snmp_payload = udp_payload(161)
+    # ASN.1 sequence with correct length
+    assert snmp_payload[0] == 0x30
+    assert snmp_payload[1] == len(snmp_payload) - 2
+    assert udp_payload(1234) == b''
+
+
+def test_udp_prober_open_port_next_to_closed_ports():
+    """
+    GIVEN a UdpProber with several sockets, closed UDP ports and an open (echo) UDP port on loopback
+    WHEN the ports are probed concurrently
+    THEN check that ICMP errors of closed ports are not attributed to the open port
+    """
+    class EchoProtocol(asyncio.DatagramProtocol):
+        def connection_made(self, transport):
+            self.transport = transport
+
+        def datagram_received(self, data, address):
+            self.transport.sendto(b'echo', address)
+
+    def closed_port():
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+        sock.close()
+        return port
+
+    async def probe_ports():
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(EchoProtocol, local_addr=('127.0.0.1', 0))
+        open_port = transport.get_extra_info('sockname')[1]
+        ports = [closed_port() for _ in range(20)] + [open_port]
+        try:
+            async with UdpProber(timeout=0.5, sockets_count=4) as prober:
+                return await asyncio.gather(*[prober.probe('127.0.0.1', str(port)) for port in ports])
+        finally:
+            transport.close()
+
+    states = asyncio.run(probe_ports())
+    assert states[-1] == 'open'
+    # Closed ports are 'open|filtered' if ICMP errors are not available (non-Linux)
+    assert all(state in ('closed', 'open|filtered') for state in states[:-1])
+    # Port without response is up only if configured
+    assert udp_state_up('open') and udp_state_up('open|filtered')
+    assert not udp_state_up('open|filtered', no_response_up=False)
+    assert not udp_state_up('closed') and not udp_state_up('filtered')
+
+
+class FailingSendSocket(socket.socket):
+    """
+    UDP socket failing the first 'sendto' calls with the specified errors.
+    """
+    def __init__(self, errors):
+        super().__init__(socket.AF_INET, socket.SOCK_DGRAM)
+        self.setblocking(False)
+        self.errors = list(errors)
+        self.sent = 0
+
+    def sendto(self, data, address):
+        if self.errors:
+            raise self.errors.pop(0)
+        self.sent += 1
+        return len(data)
+
+
+def test_udp_prober_send_errors():
+    """
+    GIVEN a UdpProber sending probes over sockets with full send buffer or pending ICMP errors
+    WHEN the targets are probed
+    THEN check that probes are sent again when the socket is writable and only ICMP errors fail the probe
+    """
+    target = ('127.0.0.1', 9)
+
+    async def send(errors):
+        async with UdpProber(timeout=0.5, sockets_count=1) as prober:
+            future = asyncio.get_running_loop().create_future()
+            prober._pending[target] = future
+            with FailingSendSocket(errors) as sock:
+                await prober._send(sock, target)
+                return future.result() if future.done() else None, sock.sent
+
+    full_buffer = [BlockingIOError(errno.EAGAIN, 'Resource temporarily unavailable'),
+                   OSError(errno.ENOBUFS, 'No buffer space available')]
+    assert asyncio.run(send(full_buffer)) == (None, 1)
+    # Pending ICMP errors of other targets are read and the payload is sent again
+    refused = OSError(errno.ECONNREFUSED, 'Connection refused')
+    assert asyncio.run(send([refused, refused])) == (None, 1)
+    assert asyncio.run(send([refused, refused, refused])) == ('filtered', 0)
+    assert asyncio.run(send([OSError(errno.EINVAL, 'Invalid argument')])) == ('filtered', 0)
+
+
+def test_probe_scheduler_limits():
+    """
+    GIVEN a ProbeScheduler with in-flight limits
+    WHEN many probes for the same host are started
+    THEN check that the number of in-flight probes never exceeds the limits
+    """
+    scheduler = ProbeScheduler(max_in_flight=10 ** 9, max_per_host=3)
+    # Global limit is capped by RLIMIT_NOFILE
+    if fd_limit() is not None:
+        assert scheduler.max_in_flight == fd_limit()
+        # Probe using several file descriptors
+        assert ProbeScheduler(max_in_flight=10 ** 9, fds_per_probe=4).max_in_flight == fd_limit() // 4
+    in_flight = []
+
+    async def probe(host):
+        async with scheduler.slot(host):
+            in_flight.append(host)
+            assert in_flight.count(host) <= 3
+            await asyncio.sleep(0.01)
+            in_flight.remove(host)
+
+    async def run_probes():
+        await asyncio.gather(*[probe(f'192.168.1.{i % 2}') for i in range(20)])
+
+    asyncio.run(run_probes())
+    assert in_flight == []
+    # Probes running in threads (max number of in-flight probes per host is recorded)
+    lock = Lock()
+    max_per_host = []
+
+    def thread_probe(host):
+        with scheduler.thread_slot(host):
+            with lock:
+                in_flight.append(host)
+                max_per_host.append(in_flight.count(host))
+            time.sleep(0.01)
+            with lock:
+                in_flight.remove(host)
+
+    threads = [Thread(target=thread_probe, args=(f'192.168.1.{i % 2}',)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert in_flight == []
+    assert max(max_per_host) == 3
+
+
+def test_dns_cache_ttl():
+    """
+    GIVEN a DnsCache with TTL limits
+    WHEN positive and negative resolution results are stored
+    THEN check that entries are returned until they expire
+    """
+    dns_cache = DnsCache(min_ttl=5, max_ttl=3600, negative_ttl=60)
+    dns_cache.set('test.service.local', '192.168.1.11', ttl=300)
+    dns_cache.set('wrong-hostname', '', ttl=300)
+    assert dns_cache.get('test.service.local') == '192.168.1.11'
+    # Negative entry
+    assert dns_cache.get('wrong-hostname') == ''
+    assert dns_cache.get('not-cached') is None
+    # Expired entry
+    dns_cache.min_ttl = -10
+    dns_cache.set('expired.service.local', '192.168.1.12', ttl=-10)
+    assert dns_cache.get('expired.service.local') is None
+
+
+def test_live_status_entry_serialization():
+    """
+    GIVEN a LiveStatusStore
+    WHEN a live status entry is dumped and loaded
+    THEN check that status and timestamps are preserved
+    """
+    live_store = LiveStatusStore(redis=None)
+    entry = {
+        'status': 'up',
+        'last_tested': datetime(2021, 3, 1, 12, 0, 30),
+        'last_responded': None,
+        'checkpoint': datetime(2021, 3, 1, 12, 0)
+    }
+    assert live_store.load(live_store.dump(entry)) == entry
+
+
+def test_serialize_raw_service():
+    """
+    GIVEN a Service document and its raw (pymongo) representation
+    WHEN the raw document is serialized with the fast serializer
+    THEN check that the output is identical to ServiceSchema output
+    """
+    service = Service(id=ObjectId(),
+                      name='test-service-ssh',
+                      host={'type': 'ip', 'value': '192.168.1.11'},
+                      proto='tcp',
+                      port='22',
+                      timestamps=Timestamps(last_tested=datetime(2021, 3, 1, 12, 0, 30, 123000),
+                                            created=datetime(2021, 3, 1, 12, 0),
+                                            edited=datetime(2021, 3, 1, 12, 0)),
+                      status='down')
+    raw_service = service.to_mongo().to_dict()
+    assert json.dumps(serialize_service(raw_service)) == json.dumps(ServiceSchema().dump(service))
+    # Default values of fields missing in db
+    del raw_service['status'], raw_service['check_interval']
+    service.status, service.check_interval = 'unknown', 30
+    assert json.dumps(serialize_service(raw_service)) == json.dumps(ServiceSchema().dump(service))
+
+
+class BulkWriteRecorder:
+    """
+    Collection recording 'bulk_write' operations.
+    """
+    def __init__(self):
+        self.batches = []
+
+    def bulk_write(self, operations, ordered=True):
+        self.batches.append(operations)
+
+
+def test_status_writer_batches(app_context, redis_client):
+    """
+    GIVEN a StatusWriter with batch size 2 and the live status store
+    WHEN probe results are added and flushed
+    THEN check that updates are written in batches and only persisted updates are written to db
+    """
+    collection = BulkWriteRecorder()
+    live_store = LiveStatusStore(redis_client, key='watchdog:live:test-writer')
+    writer = StatusWriter(collection, batch_size=2, live_store=live_store, checkpoint_interval=300)
+    service_ids = [ObjectId() for _ in range(3)]
+    tested = datetime.utcnow()
+    for service_id in service_ids:
+        writer.add(service_id, {'timestamps.last_tested': tested}, status='up', persist=False)
+    # Full batch written, services without checkpoint are persisted
+    assert len(collection.batches) == 1
+    assert [operation._filter['_id'] for operation in collection.batches[0]] == service_ids[:2]
+    writer.flush()
+    assert len(collection.batches) == 2
+    assert set(live_store.get_all()) == {str(service_id) for service_id in service_ids}
+    assert live_store.count_up() == 3
+    # Update not marked to persist (within checkpoint interval) is kept only in the live status store
+    writer.add(service_ids[0], {'timestamps.last_tested': tested}, status='up', persist=False)
+    writer.add(service_ids[1], {'status': 'down', 'timestamps.last_tested': tested}, status='down', persist=True)
+    assert len(collection.batches) == 3
+    assert [operation._filter['_id'] for operation in collection.batches[2]] == [service_ids[1]]
+    assert live_store.count_up() == 2
+    # Stale checkpoint - update is persisted with the timestamps
+    writer.checkpoint_interval = timedelta(seconds=0)
+    writer.add(service_ids[2], {'next_check': tested}, status='up', persist=False)
+    writer.flush()
+    operation = collection.batches[3][0]
+    assert operation._filter['_id'] == service_ids[2]
+    assert operation._doc['$set']['timestamps.last_tested'] == tested
+    live_store.clear()
+    # Without the live status store all updates are written to db
+    writer = StatusWriter(collection, batch_size=10)
+    writer.add(service_ids[0], {'next_check': tested}, status='up', persist=False)
+    writer.flush()
+    assert collection.batches[4][0]._doc == {'$set': {'next_check': tested}}
+
+
+def test_shard_query_boundaries(init_database):
+    """
+    GIVEN ranges of '_id' sharing the boundaries (max of range is min of the next range)
+    WHEN services are selected with the shard queries
+    THEN check that each service is selected by exactly one shard (including the last id)
+    """
+    collection = Service._get_db()['test_shards']
+    ids = sorted(ObjectId() for _ in range(6))
+    collection.insert_many([{'_id': service_id} for service_id in ids])
+    ranges = [(str(ids[0]), str(ids[2])), (str(ids[2]), str(ids[4])), (str(ids[4]), str(ids[5]))]
+    selected = [
+        [document['_id'] for document in collection.find(shard_query(id_min, id_max, last=i == len(ranges) - 1))]
+        for i, (id_min, id_max) in enumerate(ranges)
+    ]
+    collection.drop()
+    assert selected == [ids[0:2], ids[2:4], ids[4:6]]
+    assert shard_query(str(ids[0]), str(ids[2]), last=False) == {'_id': {'$gte': ids[0], '$lt': ids[2]}}
+    assert shard_query(str(ids[4]), str(ids[5]), last=True) == {'_id': {'$gte': ids[4], '$lte': ids[5]}}
+
+
+def test_get_shard_ranges(init_database):
+    """
+    GIVEN services in db
+    WHEN the services are split into shard ranges
+    THEN check that the shards cover every service matching the query exactly once
+    """
+    collection = Service._get_db()['test_shards']
+    ids = sorted(ObjectId() for _ in range(10))
+    collection.insert_many([{'_id': service_id, 'even': i % 2 == 0} for i, service_id in enumerate(ids)])
+    ranges = get_shard_ranges(collection, 3, {'even': True})
+    selected = []
+    for i, (id_min, id_max) in enumerate(ranges):
+        query = {'$and': [{'even': True}, shard_query(id_min, id_max, last=i == len(ranges) - 1)]}
+        selected.extend(document['_id'] for document in collection.find(query))
+    empty_ranges = get_shard_ranges(collection, 3, {'even': None})
+    collection.drop()
+    assert len(ranges) == 3
+    assert selected == ids[::2]
+    assert empty_ranges == []
+
+
+def test_due_query(init_database):
+    """
+    GIVEN services with past, near and future 'next_check' and services never checked
+    WHEN services are selected with the due query
+    THEN check that services due within the 'ahead' seconds and services without 'next_check' are selected
+    """
+    collection = Service._get_db()['test_due']
+    now = datetime.utcnow()
+    collection.insert_many([
+        {'_id': 'past', 'next_check': now - timedelta(seconds=10)},
+        {'_id': 'near', 'next_check': now + timedelta(seconds=3)},
+        {'_id': 'future', 'next_check': now + timedelta(seconds=60)},
+        {'_id': 'none', 'next_check': None},
+        {'_id': 'missing'}
+    ])
+    due = {document['_id'] for document in collection.find(due_query())}
+    due_ahead = {document['_id'] for document in collection.find(due_query(ahead=5))}
+    collection.drop()
+    assert due == {'past', 'none', 'missing'}
+    assert due_ahead == {'past', 'near', 'none', 'missing'}
+
+
+class CountingProbeEngine(AsyncProbeEngine):
+    """
+    Probe engine counting probed endpoints (without network access).
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.probed = []
+
+    async def port_status(self, proto: str, ip_address: str, port) -> bool:
+        self.probed.append((ip_address, port, proto))
+        return port == 22
+
+
+def test_check_batch_endpoint_dedup(app_context):
+    """
+    GIVEN services sharing endpoints (the same ip or hostname resolved to the same ip, port and protocol)
+    WHEN the batch of services is checked
+    THEN check that each distinct endpoint is probed once and the result is fanned out to all its services
+    """
+    dns_cache = DnsCache()
+    dns_cache.set('shared.service.local', '10.0.0.1', ttl=60)
+    dns_cache.set('unresolved.service.local', '', ttl=60)
+    engine = CountingProbeEngine(dns_cache=dns_cache)
+    services = [
+        {'name': 'ssh-ip', 'host': {'type': 'ip', 'value': '10.0.0.1'}, 'port': '22', 'proto': 'tcp'},
+        {'name': 'ssh-hostname', 'host': {'type': 'hostname', 'value': 'shared.service.local'},
+         'port': '22', 'proto': 'tcp'},
+        {'name': 'ssh-ip-int-port', 'host': {'type': 'ip', 'value': '10.0.0.1'}, 'port': 22, 'proto': 'tcp'},
+        {'name': 'dns-udp', 'host': {'type': 'ip', 'value': '10.0.0.1'}, 'port': '53', 'proto': 'udp'},
+        {'name': 'dns-tcp', 'host': {'type': 'ip', 'value': '10.0.0.1'}, 'port': '53', 'proto': 'tcp'},
+        {'name': 'unresolved', 'host': {'type': 'hostname', 'value': 'unresolved.service.local'},
+         'port': '22', 'proto': 'tcp'}
+    ]
+    results = asyncio.run(engine.check_batch(services))
+    assert sorted(engine.probed) == [('10.0.0.1', 22, 'tcp'), ('10.0.0.1', 53, 'tcp'), ('10.0.0.1', 53, 'udp')]
+    assert {service['name']: response for service, response in results} == {
+        'ssh-ip': True,
+        'ssh-hostname': True,
+        'ssh-ip-int-port': True,
+        'dns-udp': False,
+        'dns-tcp': False,
+        'unresolved': None
+    }
+
+
+def test_service_counters(redis_client):
+    """
+    GIVEN the services counter cached in Redis
+    WHEN the total is read and the counter is changed
+    THEN check that db is counted only on cache miss and the counter is changed only if it is cached
+    """
+    counters = ServiceCounters(redis_client, key='services:total:test-counters', ttl=60)
+    redis_client.delete(counters.key)
+    counts = []
+
+    def count():
+        counts.append(1)
+        return 5
+
+    # Missing counter is not created by increment
+    counters.increment(2)
+    assert redis_client.get(counters.key) is None
+    assert counters.get_total(count) == 5
+    assert counters.get_total(count) == 5
+    assert len(counts) == 1
+    counters.increment(2)
+    counters.increment(-1)
+    assert counters.get_total(count) == 6
+    assert 0 < redis_client.ttl(counters.key) <= 60
+    counters.reset()
+    assert counters.get_total(count) == 0
+    assert len(counts) == 1
+    redis_client.delete(counters.key)
+
+
+class CountingDnsCache(DnsCache):
+    """
+    DNS cache recording the number of concurrent queries (without network access).
+    """
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def resolve_async(self, hostname: str) -> str:
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        self.set(hostname, '10.0.0.1', ttl=60)
+        return '10.0.0.1'
+
+
+def test_check_batch_dns_queries_limited(app_context):
+    """
+    GIVEN a batch of services with many distinct hostnames
+    WHEN the batch of services is checked
+    THEN check that the number of concurrent DNS queries does not exceed the scheduler limit
+    """
+    dns_cache = CountingDnsCache()
+    engine = CountingProbeEngine(scheduler=ProbeScheduler(max_in_flight=4), dns_cache=dns_cache)
+    services = [
+        {'name': f'service-{i}', 'host': {'type': 'hostname', 'value': f'host-{i}.service.local'},
+         'port': '22', 'proto': 'tcp'}
+        for i in range(20)
+    ]
+    results = asyncio.run(engine.check_batch(services))
+    assert dns_cache.max_in_flight == 4
+    assert all(response for _, response in results)
+    assert engine.probed == [('10.0.0.1', 22, 'tcp')]
+
+
+def test_update_service_status_next_check(app_context):
+    """
+    GIVEN services checked in a sweep started earlier
+    WHEN the results of the checks are added
+    THEN check that 'next_check' is computed from the sweep start time (not from the end of the check)
+    """
+    # Monitoring service without db and Redis (only the writer is used)
+    monitoring = MonitoringService.__new__(MonitoringService)
+    collection = BulkWriteRecorder()
+    monitoring.writer = StatusWriter(collection, batch_size=10)
+    started = datetime.utcnow() - timedelta(seconds=20)
+    services = [
+        {'_id': ObjectId(), 'name': 'up', 'status': 'up'},
+        {'_id': ObjectId(), 'name': 'unresolved', 'status': 'up', 'check_interval': 60},
+        {'_id': ObjectId(), 'name': 'interval', 'status': 'down'}
+    ]
+    monitoring.update_service_status(services[0], True, started)
+    monitoring.update_service_status(services[1], None, started)
+    monitoring.update_service_status(services[2], True)
+    monitoring.writer.flush()
+    updates = [operation._doc['$set'] for operation in collection.batches[0]]
+    assert updates[0]['next_check'] == started + timedelta(seconds=monitoring.default_interval)
+    assert updates[1]['next_check'] == started + timedelta(seconds=60)
+    # Without the sweep start the next check is computed from the check time
+    assert updates[2]['next_check'] == updates[2]['timestamps.last_tested'] + timedelta(
+        seconds=monitoring.default_interval)
+
+
+def test_sweep_retention(init_database):
+    """
+    GIVEN sweep records collection without the TTL index
+    WHEN the sweep records retention is ensured
+    THEN check that the TTL index is created only once
+    """
+    db = Service._get_db()
+    db.watchdog_sweep.drop()
+    assert get_sweep_retention(db) is None
+    assert ensure_sweep_retention(db, 3600)
+    assert get_sweep_retention(db) == 3600
+    assert not ensure_sweep_retention(db, 3600)
+    db.watchdog_sweep.drop()
+
+
+def test_sweep_lease(redis_client):
+    """
+    GIVEN the sweep lease in Redis
+    WHEN the lease is acquired, released and the sweep is requested while the lease is held
+    THEN check that only one sweep holds the lease and the requested sweep is coalesced into one pending flag
+    """
+    lease = SweepLease(redis_client, key='watchdog:sweep:lease:test-lease', ttl=60)
+    redis_client.delete(lease.key, lease.pending_key)
+    token = lease.acquire()
+    assert token
+    assert 0 < redis_client.ttl(lease.key) <= 60
+    assert lease.acquire() is None
+    # Lease is released only by its owner
+    assert not lease.release('other-token')
+    assert lease.release(token)
+    assert not lease.release(token)
+    assert not lease.pop_pending()
+    lease.mark_pending()
+    lease.mark_pending()
+    assert lease.pop_pending()
+    assert not lease.pop_pending()
+    token = lease.acquire()
+    assert token
+    lease.release(token)
+
+
+class FailingRedis:
+    """
+    Redis client timing out on every command.
+    """
+    def __getattr__(self, name):
+        def command(*args, **kwargs):
+            raise RedisTimeoutError('Timeout reading from socket')
+        return command
+
+
+def test_watchdog_task_lease_held(app_context, redis_client, monkeypatch):
+    """
+    GIVEN the sweep lease held by a running sweep
+    WHEN the watchdog task is started
+    THEN check that the run is skipped (and coalesced into one pending sweep with 'coalesce' overlap)
+    """
+    monkeypatch.setattr(redis_store, '_client', redis_client)
+    current_app.config.update(WATCHDOG_SWEEP_LEASE_TTL=60, WATCHDOG_SWEEP_OVERLAP='skip')
+    lease = get_sweep_lease()
+    metrics = SweepMetrics(redis_client)
+    redis_client.delete(lease.key, lease.pending_key, metrics.key)
+    token = lease.acquire()
+    watchdog_task()
+    assert metrics.get()['skipped_runs'] == 1
+    assert not lease.pop_pending()
+    current_app.config['WATCHDOG_SWEEP_OVERLAP'] = 'coalesce'
+    watchdog_task()
+    watchdog_task()
+    assert metrics.get()['skipped_runs'] == 3
+    assert lease.pop_pending()
+    assert lease.release(token)
+    redis_client.delete(metrics.key)
+    # Redis timeout - the run is skipped and metrics are empty
+    monkeypatch.setattr(redis_store, '_client', FailingRedis())
+    watchdog_task()
+    assert get_watchdog_metrics() == {}
+
+
+def test_interval_scheduler():
+    """
+    GIVEN an IntervalScheduler with services of different check intervals
+    WHEN the scheduler runs for a short duration
+    THEN check that services are checked in due order, rescheduled from their due time and not after duration
+    """
+    checks = []
+
+    async def check(batch):
+        loop = asyncio.get_running_loop()
+        checks.extend((service['name'], loop.time()) for service in batch)
+        # Slow check does not delay next checks
+        await asyncio.sleep(0.03)
+
+    async def run_scheduler():
+        loop = asyncio.get_running_loop()
+        scheduler = IntervalScheduler(check, default_interval=0.1)
+        start = loop.time()
+        scheduler.schedule({'name': 'fast'}, start)
+        scheduler.schedule({'name': 'slow', 'check_interval': 0.25}, start + 0.02)
+        await scheduler.run(0.55)
+        end = loop.time()
+        return start, end, sorted((due, service['name']) for due, _, service in scheduler._heap)
+
+    start, end, next_checks = asyncio.run(run_scheduler())
+    assert [name for name, _ in checks] == ['fast', 'slow', 'fast', 'fast', 'slow', 'fast', 'fast', 'fast', 'slow']
+    assert all(checked - start <= 0.55 for _, checked in checks)
+    assert end - start < 0.65
+    # Services are rescheduled from their due time (no drift caused by delayed checks)
+    assert next_checks[0] == (pytest.approx(start + 0.6), 'fast')
+    assert next_checks[1] == (pytest.approx(start + 0.77), 'slow')
+
+
+def test_async_probe_engine_tcp(app_context):
+    """
+    GIVEN a listening TCP port and a closed TCP port on loopback
+    WHEN the services are checked with the asyncio probe engine
+    THEN check that the listening port is up and the closed port is down
+    """
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listening, \
+            socket.socket(socket.AF_INET, socket.SOCK_STREAM) as closed:
+        listening.bind(('127.0.0.1', 0))
+        listening.listen()
+        closed.bind(('127.0.0.1', 0))
+        services = [
+            {'name': 'listening', 'host': {'type': 'ip', 'value': '127.0.0.1'},
+             'port': str(listening.getsockname()[1]), 'proto': 'tcp'},
+            # Bound socket without listen() refuses connections
+            {'name': 'closed', 'host': {'type': 'ip', 'value': '127.0.0.1'},
+             'port': str(closed.getsockname()[1]), 'proto': 'tcp'}
+        ]
+        results = AsyncProbeEngine(timeout=1).run(services)
+    assert {service['name']: response for service, response in results} == {'listening': True, 'closed': False}